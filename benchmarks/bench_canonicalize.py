@@ -0,0 +1,67 @@
+''' Reports how many fetches url canonicalization saves on a recorded crawl.
+
+    python -m benchmarks.bench_canonicalize [--data_dir DIR] [--keep_params a,b]
+
+Reads the "status - url - sizes" lines the scraper writes to data/*.txt and
+counts the distinct urls the frontier would fetch with the original
+normalize (strip the trailing slash) and with the canonicalizer. '''
+import os
+import time
+from argparse import ArgumentParser
+from collections import Counter
+
+from utils.canonical import Canonicalizer
+
+
+def original_normalize(url):
+    # utils.normalize before the canonicalizer
+    if url.endswith("/"):
+        return url.rstrip("/")
+    return url
+
+
+def without_scheme(url):
+    # the frontier hashes urls without their scheme
+    return url.partition("://")[2]
+
+
+def load_urls(data_dir):
+    urls = []
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(data_dir, name), encoding="utf-8", errors="replace") as data_file:
+            for line in data_file:
+                parts = line.strip().split(" - ")
+                if len(parts) >= 2 and "://" in parts[1]:
+                    urls.append(parts[1])
+    return urls
+
+
+def main(data_dir, keep_params):
+    urls = load_urls(data_dir)
+    if not urls:
+        print(f"No recorded urls in {data_dir}")
+        return
+    canonicalizer = Canonicalizer(keep_params=keep_params)
+    original = {without_scheme(original_normalize(url)): url for url in urls}
+    start = time.perf_counter()
+    canonical = Counter(
+        without_scheme(canonicalizer.canonicalize(url)) for url in original.values())
+    elapsed = time.perf_counter() - start
+    saved = len(original) - len(canonical)
+    print(f"{len(urls)} recorded fetches, {len(original)} distinct urls with the original normalize")
+    print(f"{len(canonical)} distinct urls canonicalized: "
+          f"{saved} fetches saved ({saved / len(original):.1%})")
+    print(f"canonicalized {len(original) / elapsed:,.0f} urls/sec")
+    for url, count in canonical.most_common(10):
+        if count > 1:
+            print(f"  {count:4} urls -> {url}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data")
+    parser.add_argument("--keep_params", type=str, default="")
+    args = parser.parse_args()
+    main(args.data_dir, [param for param in args.keep_params.split(",") if param])
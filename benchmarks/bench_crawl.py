@@ -0,0 +1,154 @@
+''' Crawls a local stand-in cache server with each engine and frontier mode,
+and reports pages/sec, CPU per page, memory growth and dedup accuracy.
+
+    python -m benchmarks.bench_crawl [--site synthetic|recorded] [--latency 0.01]
+        [--engines thread async] [--frontiers host priority] [--threads 4]
+
+The server (utils.cache_server) runs in this process and every crawl in its
+own process and temporary folder, so CPU and memory are the crawler's alone.
+Dedup accuracy compares the pages kept as unique with the near duplicate
+groups of the synthetic site: recall is the share of fetched duplicates that
+were dropped, lost are originals of which no copy was kept. The dedup column
+counts the duplicates dropped by the exact text fingerprint, SimHash and
+minhash tiers. --mirrors makes a share of the duplicates exact copies, and
+--simhash sets scraper.simhash_distance. '''
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from utils.cache_server import CacheServer, get_site
+from benchmarks.bench_frontier_memory import resident_bytes
+
+
+def crawl(args):
+    ''' Runs one crawl, in the child process. '''
+    import scraper
+    from utils.config import Config
+    from utils.metrics import metrics
+    from crawler import Crawler
+    from launch import ENGINES, FRONTIERS
+
+    os.chdir(args.work_dir)
+    scraper.tokenizer = args.tokenizer
+    scraper.simhash_distance = args.simhash
+    # keep every unique page in the statistics log
+    scraper.analytics.fold_size = float("inf")
+    site = get_site(args.site, args.data_dir, args.hosts, args.pages, mirror_rate=args.mirrors)
+    cparser = ConfigParser()
+    cparser.read(args.config_file)
+    config = Config(cparser)
+    config.cache_server = (args.host, args.port)
+    config.seed_urls = site.seed_urls
+    config.time_delay = args.politeness
+    config.threads_count = args.threads
+    config.metrics = False
+    metrics.start()
+
+    start_memory = resident_bytes()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    Crawler(config, True, frontier_factory=FRONTIERS[args.frontier],
+            worker_factory=ENGINES[args.engine]).start()
+    if scraper.initialized:
+        scraper.write_data()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    memory = resident_bytes() - start_memory
+
+    kept = list()
+    if os.path.exists(scraper.analytics_log_path):
+        with open(scraper.analytics_log_path, encoding="utf-8", errors="replace") as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a record torn by concurrent writers
+                    continue
+                # the first line is the generation of the log
+                if "url" in record:
+                    kept.append(record["url"])
+    content = list()
+    for name in os.listdir("data"):
+        with open(os.path.join("data", name), encoding="utf-8", errors="replace") as data_file:
+            for line in data_file:
+                status, url, sizes = line.rstrip("\n").split(" - ", 2)
+                text_size, _, page_size = sizes.partition("/")
+                if (status == "200" and text_size.isdigit() and int(text_size) >= scraper.min_size
+                        and int(text_size) / int(page_size) >= scraper.min_part):
+                    content.append(url)
+    fetched = sum(count for name, count in metrics.counters.items() if name.startswith("status_"))
+    dedup = [metrics.counters[f"dedup_{tier}"] for tier in ("exact", "simhash", "minhash")]
+    print(json.dumps({"elapsed": elapsed, "cpu": cpu, "memory": memory,
+                      "fetched": fetched, "kept": kept, "content": content, "dedup": dedup}))
+
+
+def main(args):
+    site = get_site(args.site, args.data_dir, args.hosts, args.pages, mirror_rate=args.mirrors)
+    server = CacheServer(site, latency=args.latency, jitter=args.latency / 2)
+    host, port = server.start()
+    print(f"{args.site} site, {args.latency * 1000:.0f} ms latency, {args.threads} threads")
+    print(f"{'engine':>7} {'frontier':>9} {'pages':>6} {'pages/s':>8} {'cpu ms/page':>12} "
+          f"{'memory MB':>10} {'recall':>7} {'lost':>5} {'dedup':>12}")
+    for engine in args.engines:
+        for frontier in args.frontiers:
+            with tempfile.TemporaryDirectory() as work_dir:
+                out = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_crawl", "--child",
+                     "--work_dir", work_dir, "--host", host, "--port", str(port),
+                     "--engine", engine, "--frontier", frontier,
+                     "--config_file", os.path.abspath(args.config_file),
+                     "--data_dir", os.path.abspath(args.data_dir),
+                     "--site", args.site, "--hosts", str(args.hosts), "--pages", str(args.pages),
+                     "--threads", str(args.threads), "--politeness", str(args.politeness),
+                     "--tokenizer", args.tokenizer, "--mirrors", str(args.mirrors)]
+                    + (["--simhash", str(args.simhash)] if args.simhash is not None else []),
+                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            kept_groups = {site.group(url) for url in result["kept"]}
+            content_groups = {site.group(url) for url in result["content"]}
+            duplicates = len(result["content"]) - len(content_groups)
+            kept_duplicates = len(result["kept"]) - len(kept_groups)
+            recall = 1 - kept_duplicates / duplicates if duplicates else 1.0
+            fetched = max(result["fetched"], 1)
+            print(f"{engine:>7} {frontier:>9} {result['fetched']:>6} "
+                  f"{result['fetched'] / result['elapsed']:>8.1f} "
+                  f"{result['cpu'] / fetched * 1000:>12.2f} "
+                  f"{result['memory'] / 2 ** 20:>10.1f} {recall:>7.3f} "
+                  f"{len(content_groups - kept_groups):>5} "
+                  f"{'/'.join(str(count) for count in result['dedup']):>12}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--site", choices=("synthetic", "recorded"), default="synthetic")
+    parser.add_argument("--data_dir", type=str, default="data")
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--engines", nargs="+", default=["thread", "async"])
+    parser.add_argument("--frontiers", nargs="+", default=["host", "priority"])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--politeness", type=float, default=0.0)
+    parser.add_argument("--tokenizer", choices=("nltk", "regex"), default="nltk")
+    parser.add_argument("--mirrors", type=float, default=0.0,
+                        help="share of the synthetic duplicates that are exact copies")
+    parser.add_argument("--simhash", type=int, default=None,
+                        help="max SimHash distance of duplicates, off if not given")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--child", action="store_true", help="Internal, runs one crawl.")
+    parser.add_argument("--work_dir", type=str)
+    parser.add_argument("--host", type=str)
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--engine", type=str)
+    parser.add_argument("--frontier", type=str)
+    args = parser.parse_args()
+    if args.child:
+        crawl(args)
+    else:
+        main(args)
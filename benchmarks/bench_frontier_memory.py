@@ -0,0 +1,62 @@
+''' Reports the memory the frontier's seen set and host queues take per url,
+with and without COMPACT.
+
+    python -m benchmarks.bench_frontier_memory [--sizes 1000000 10000000]
+
+Every mode and size runs in its own process, and memory is measured as
+the growth of its resident set size. '''
+import sys
+import subprocess
+from argparse import ArgumentParser
+
+from utils import get_urlhash
+from utils.locks import StripedSet
+from utils.compact import FingerprintTable, PackedQueue, pack_url
+
+HOSTS = [f"{name}.ics.uci.edu" for name in (
+    "www", "vision", "cml", "sli", "evoke", "hombao", "mondego", "wics",
+    "ngs", "asterix", "grape", "intranet", "swiki", "flamingo", "archive")]
+
+
+def resident_bytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * 4096
+
+
+def make_url(i):
+    host = HOSTS[i % len(HOSTS)]
+    return host, f"https://{host}/people/group{i % 997}/page-{i}/index"
+
+
+def measure(mode, size):
+    compact = mode == "compact"
+    start = resident_bytes()
+    seen = StripedSet(factory=FingerprintTable if compact else set)
+    queues = {host: PackedQueue() if compact else list() for host in HOSTS}
+    for i in range(size):
+        host, url = make_url(i)
+        seen.add(get_urlhash(url))
+        queues[host].append(pack_url(host, url) if compact else url)
+    return (resident_bytes() - start) / size
+
+
+def main(sizes, modes):
+    for size in sizes:
+        for mode in modes:
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_frontier_memory",
+                 "--child", mode, str(size)],
+                capture_output=True, text=True, check=True).stdout
+            print(f"{mode:>8} {size:>10} urls: {float(out):6.1f} bytes/url")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument("--modes", nargs="+", default=["default", "compact"])
+    parser.add_argument("--child", nargs=2, default=None, help="Internal, measures one mode and size.")
+    args = parser.parse_args()
+    if args.child:
+        print(measure(args.child[0], int(args.child[1])))
+    else:
+        main(args.sizes, args.modes)
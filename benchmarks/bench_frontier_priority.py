@@ -0,0 +1,129 @@
+''' Replays a recorded crawl through the host and priority frontiers and
+reports the unique pages found per fetch with the same fetch budget.
+
+    python -m benchmarks.bench_frontier_priority [--data_dir DIR] [--budget 0.5]
+
+The pages and their outcomes come from the "status - url - text/page sizes"
+lines in data/*.txt. A page is unique if it was downloaded and had at least
+scraper.min_size characters of text. The recorded logs do not keep links, so
+each page links to the recorded pages one path level below it, and every
+host's shallowest page is a seed. '''
+import os
+import time
+import tempfile
+from argparse import ArgumentParser
+from collections import defaultdict
+
+import scraper
+from utils import normalize
+from utils.traps import TrapDetector
+from crawler.frontier import Frontier, get_host
+from crawler.priority_frontier import PriorityFrontier
+
+FRONTIERS = {"host": Frontier, "priority": PriorityFrontier}
+
+
+class ReplayConfig(object):
+    time_delay = 0.0
+    commit_size = 1000
+    commit_interval = 1.0
+    compact_size = 1000000
+    compact = False
+    keep_params = []
+    priority_heap = 1000000
+    recrawl = False
+
+    def __init__(self, seed_urls):
+        self.save_file = "frontier.shelve"
+        self.seed_urls = seed_urls
+
+
+def load_pages(data_dir):
+    ''' Returns {url: unique} of the recorded pages. '''
+    pages = dict()
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(data_dir, name), encoding="utf-8", errors="replace") as data_file:
+            for line in data_file:
+                parts = line.strip().split(" - ")
+                if len(parts) < 3 or "://" not in parts[1]:
+                    continue
+                sizes = parts[2].split("/")
+                unique = (parts[0] == "200" and sizes[0].isdigit()
+                          and int(sizes[0]) >= scraper.min_size)
+                pages[normalize(parts[1])] = unique
+    return pages
+
+
+def build_links(pages):
+    ''' Links each page to the pages one path level below it, returns the
+    links and the shallowest page of each host. '''
+    links = defaultdict(list)
+    roots = dict()
+    for url in pages:
+        parent = url.rpartition("/")[0]
+        if parent in pages and "://" in parent[:-1]:
+            links[parent].append(url)
+        host = get_host(url)
+        if host not in roots or url.count("/") < roots[host].count("/"):
+            roots[host] = url
+    # pages whose parent was not recorded are linked from their host's root
+    for url in pages:
+        parent = url.rpartition("/")[0]
+        root = roots[get_host(url)]
+        if parent not in pages and url != root:
+            links[root].append(url)
+    return links, sorted(roots.values())
+
+
+def replay(frontier_factory, pages, links, seeds, budget):
+    scraper.traps = TrapDetector()
+    frontier = frontier_factory(ReplayConfig(seeds), True)
+    fetched = unique = 0
+    start = time.perf_counter()
+    while fetched < budget:
+        url = frontier.get_tbd_url(timeout=0)
+        if url is None:
+            break
+        fetched += 1
+        found = pages.get(url, False)
+        unique += found
+        scraper.traps.record(url, not found)
+        for link in links.get(url, ()):
+            frontier.add_url(link)
+        frontier.mark_url_complete(url)
+    elapsed = time.perf_counter() - start
+    frontier.journal.close()
+    return fetched, unique, elapsed
+
+
+def main(data_dir, budget):
+    pages = load_pages(data_dir)
+    if not pages:
+        print(f"No recorded pages in {data_dir}")
+        return
+    links, seeds = build_links(pages)
+    fetches = int(len(pages) * budget)
+    print(f"{len(pages)} recorded pages, {sum(pages.values())} unique, "
+          f"{len(seeds)} hosts, budget {fetches} fetches")
+    data_dir = os.path.abspath(data_dir)
+    cwd = os.getcwd()
+    for name, frontier_factory in FRONTIERS.items():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                fetched, unique, elapsed = replay(frontier_factory, pages, links, seeds, fetches)
+            finally:
+                os.chdir(cwd)
+        print(f"{name:>9}: {unique} unique pages in {fetched} fetches, "
+              f"{unique / max(fetched, 1):.3f} per fetch, {fetched / elapsed:,.0f} fetches/sec")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--data_dir", type=str, default="data")
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="fetch budget as a share of the recorded pages")
+    args = parser.parse_args()
+    main(args.data_dir, args.budget)
@@ -0,0 +1,95 @@
+''' Reports how long worker threads spend logging a line per url, with the
+original handlers that write and flush in the calling thread, and with the
+log writer thread of utils.logs.
+
+    python -m benchmarks.bench_logging [--threads 1 8 32] [--lines 20000]
+
+Every worker logs to Logs/Worker.log and the console, as crawler workers
+do. The console goes to os.devnull, so terminal speed does not count. '''
+import os
+import sys
+import time
+import logging
+import tempfile
+from threading import Thread
+from argparse import ArgumentParser
+
+from utils import logs
+from utils.logs import FORMAT, URL_LINE
+
+
+def sync_logger(name, filename):
+    ''' Logger set up the way get_logger did before utils.logs. '''
+    logger = logging.getLogger(f"sync-{name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    file_handler = logging.FileHandler(f"Logs/{filename}.log")
+    file_handler.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    formatter = logging.Formatter(FORMAT)
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+    return logger
+
+
+def run(mode, threads, lines):
+    if mode == "sync":
+        loggers = [sync_logger(f"Worker-{i}", "Worker") for i in range(threads)]
+    else:
+        loggers = [logs.get_logger(f"{mode}-Worker-{i}", "Worker") for i in range(threads)]
+
+    def work(logger):
+        for i in range(lines):
+            logger.info(
+                f"Downloaded https://www.ics.uci.edu/page/{i}, status <200>, "
+                f"using cache ('styx.ics.uci.edu', 9000).", extra=URL_LINE)
+
+    workers = [Thread(target=work, args=(logger,)) for logger in loggers]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logged = time.perf_counter() - start
+    logs.flush()
+    written = time.perf_counter() - start
+    for logger in loggers:
+        for handler in logger.handlers:
+            handler.close()
+        logger.handlers.clear()
+    return logged, written
+
+
+def main(thread_counts, lines, sample):
+    cwd = os.getcwd()
+    stderr = sys.stderr
+    with tempfile.TemporaryDirectory() as temp_dir, open(os.devnull, "w") as devnull:
+        os.chdir(temp_dir)
+        os.makedirs("Logs")
+        sys.stderr = devnull
+        results = list()
+        try:
+            for threads in thread_counts:
+                for mode in ("sync", "queue"):
+                    logs.configure(url_sample=sample if mode == "queue" else 1.0)
+                    results.append((mode, threads) + run(mode, threads, lines))
+        finally:
+            sys.stderr = stderr
+            os.chdir(cwd)
+    for mode, threads, logged, written in results:
+        total = threads * lines
+        print(f"{mode:>6} {threads:>3} threads: {logged / total * 1e6:6.1f} us per line in "
+              f"the workers, all {total} lines written after {written:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--lines", type=int, default=20000, help="lines per thread")
+    parser.add_argument("--sample", type=float, default=1.0,
+                        help="URLLOGSAMPLE of the queue mode")
+    args = parser.parse_args()
+    main(args.threads, args.lines, args.sample)
@@ -0,0 +1,140 @@
+''' Crawls editions of the synthetic site served by the local cache server,
+each with a recrawl that keeps the fetch history of the editions before it
+and with a full crawl from the seeds in a fresh folder, and reports what
+each costs.
+
+    python -m benchmarks.bench_recrawl [--editions 3] [--change_rate 0.1]
+        [--no_validators]
+
+Every edition after the first changes change_rate of the pages on average.
+For each crawl the report has the pages fetched, parsed and tokenized, the
+seconds and CPU seconds taken, and for recrawls the pages found unchanged by
+their validators or their text, and the share of the changed pages fetched
+in the first half of the fetches. With --no_validators the server sends no
+ETags, so recrawls parse every page. '''
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from utils.cache_server import CacheServer, SyntheticSite
+
+
+def crawl(args):
+    ''' Runs one crawl, in the child process. '''
+    import scraper
+    from utils.config import Config
+    from utils.metrics import metrics
+    from crawler import Crawler
+
+    os.chdir(args.work_dir)
+    scraper.tokenizer = args.tokenizer
+    cparser = ConfigParser()
+    cparser.read(args.config_file)
+    config = Config(cparser)
+    config.cache_server = (args.host, args.port)
+    config.seed_urls = SyntheticSite(args.hosts, args.pages).seed_urls
+    config.time_delay = 0.0
+    config.threads_count = args.threads
+    config.metrics = False
+    config.recrawl = args.recrawl
+    metrics.start()
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    Crawler(config, not args.recrawl).start()
+    if scraper.initialized:
+        scraper.write_data()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+
+    # urls in the order they were fetched in this crawl
+    fetched = sorted(
+        (record.last_fetch, record.url) for record in scraper.history.db.values()
+        if record.last_fetch >= time.time() - elapsed)
+    scraper.history.close()
+    histograms = metrics.histograms
+    print(json.dumps({
+        "elapsed": elapsed, "cpu": cpu,
+        "fetched": [url for _, url in fetched],
+        "parsed": histograms["parse"].count if "parse" in histograms else 0,
+        "tokenized": histograms["tokenize"].count if "tokenize" in histograms else 0,
+        "validators": metrics.counters["unchanged_validators"],
+        "text": metrics.counters["unchanged_text"]}))
+
+
+def run_child(args, server, work_dir, recrawl):
+    host, port = server.server_address[:2]
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_recrawl", "--child",
+         "--work_dir", work_dir, "--host", host, "--port", str(port),
+         "--config_file", os.path.abspath(args.config_file),
+         "--hosts", str(args.hosts), "--pages", str(args.pages),
+         "--threads", str(args.threads), "--tokenizer", args.tokenizer]
+        + (["--recrawl"] if recrawl else []),
+        capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(args):
+    server = CacheServer(
+        SyntheticSite(args.hosts, args.pages), latency=args.latency,
+        jitter=args.latency / 2, validators=not args.no_validators)
+    server.start()
+    print(f"synthetic site, {args.hosts} hosts x {args.pages} pages, "
+          f"{args.change_rate:.0%} changed per edition, "
+          f"{'no ' if args.no_validators else ''}ETags")
+    print(f"{'edition':>7} {'crawl':>7} {'fetched':>8} {'parsed':>7} {'tokenized':>10} "
+          f"{'seconds':>8} {'cpu s':>6} {'unchanged':>10} {'changed early':>14}")
+    with tempfile.TemporaryDirectory() as recrawl_dir:
+        for edition in range(args.editions):
+            site = SyntheticSite(
+                args.hosts, args.pages, edition=edition, change_rate=args.change_rate)
+            server.site = site
+            modes = ("full",) if edition == 0 else ("recrawl", "full")
+            for mode in modes:
+                if mode == "recrawl":
+                    result = run_child(args, server, recrawl_dir, True)
+                elif edition == 0:
+                    result = run_child(args, server, recrawl_dir, False)
+                else:
+                    with tempfile.TemporaryDirectory() as work_dir:
+                        result = run_child(args, server, work_dir, False)
+                fetched = result["fetched"]
+                unchanged = early = ""
+                if mode == "recrawl":
+                    unchanged = f"{result['validators']}+{result['text']}"
+                    changed = [i for i, url in enumerate(fetched) if site.changed(url, edition)]
+                    if changed:
+                        early = f"{sum(i < len(fetched) / 2 for i in changed) / len(changed):.2f}"
+                print(f"{edition:>7} {mode:>7} {len(fetched):>8} {result['parsed']:>7} "
+                      f"{result['tokenized']:>10} {result['elapsed']:>8.2f} "
+                      f"{result['cpu']:>6.2f} {unchanged:>10} {early:>14}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--editions", type=int, default=3)
+    parser.add_argument("--change_rate", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--no_validators", action="store_true")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--tokenizer", choices=("nltk", "regex"), default="nltk")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--child", action="store_true", help="Internal, runs one crawl.")
+    parser.add_argument("--work_dir", type=str)
+    parser.add_argument("--host", type=str)
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--recrawl", action="store_true")
+    args = parser.parse_args()
+    if args.child:
+        crawl(args)
+    else:
+        main(args)
@@ -0,0 +1,83 @@
+''' Reports how long a restarted frontier takes to load its save file and
+hand out the first url, from the checkpoint and from a full scan of the
+snapshot.
+
+    python -m benchmarks.bench_resume [--urls 1000000] [--pending 0.1]
+
+The save file is made once with the given number of urls, of which the
+pending share is not downloaded yet. The full scan is forced by removing
+the checkpoint file, and writes a new checkpoint as part of its load. '''
+import os
+import time
+import tempfile
+from argparse import ArgumentParser
+
+import scraper
+from utils import get_urlhash
+from utils import canonical
+from utils.store import open_shelf
+from utils.traps import TrapDetector
+from crawler.frontier import Frontier
+from crawler.journal import Journal
+from benchmarks.bench_frontier_memory import make_url
+from benchmarks.bench_frontier_priority import ReplayConfig
+
+
+def make_save(save_file, urls, pending):
+    done = urls - int(urls * pending)
+    urlhashes = list()
+    checkpoint = list()
+    with open_shelf(save_file) as snapshot:
+        for i in range(urls):
+            host, url = make_url(i)
+            urlhash = get_urlhash(url)
+            snapshot[urlhash] = (url, i < done)
+            urlhashes.append(urlhash)
+            if i >= done:
+                checkpoint.append((urlhash, url))
+    journal = Journal(save_file, 1000, 1.0, 1000000, tag=canonical.canonicalizer.signature)
+    journal.write_checkpoint(urlhashes, checkpoint)
+    journal.close()
+
+
+def resume(save_file, compact):
+    config = ReplayConfig([])
+    config.save_file = save_file
+    config.compact = compact
+    start = time.perf_counter()
+    frontier = Frontier(config, False)
+    loaded = time.perf_counter() - start
+    frontier.get_tbd_url(timeout=0)
+    first = time.perf_counter() - start
+    frontier.journal.close()
+    return loaded, first
+
+
+def main(urls, pending, compact):
+    scraper.traps = TrapDetector()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            save_file = "frontier.shelve"
+            start = time.perf_counter()
+            make_save(save_file, urls, pending)
+            print(f"{urls} urls, {int(urls * pending)} pending, "
+                  f"save made in {time.perf_counter() - start:.1f}s")
+            loaded, first = resume(save_file, compact)
+            print(f"checkpoint: loaded in {loaded:.2f}s, first url after {first:.2f}s")
+            os.remove(f"{save_file}.checkpoint")
+            loaded, first = resume(save_file, compact)
+            print(f"full scan:  loaded in {loaded:.2f}s, first url after {first:.2f}s")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--urls", type=int, default=1000000)
+    parser.add_argument("--pending", type=float, default=0.1,
+                        help="share of the urls not downloaded yet")
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args()
+    main(args.urls, args.pending, args.compact)
@@ -0,0 +1,97 @@
+''' Measures tokens/sec of scraper.tokenize_words against the original
+tokenizer on a fixed HTML corpus.
+
+    python -m benchmarks.bench_tokenize [--pages N] [--html_dir DIR]
+
+Without --html_dir the corpus is generated from a fixed seed, so runs are
+comparable across commits. '''
+import os
+import re
+import time
+import random
+from argparse import ArgumentParser
+
+from lxml import html
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+from datasketch import MinHash, LeanMinHash
+
+import scraper
+
+WORDS = (
+    "the of and to in is for on with as by at from that this be are or "
+    "research student students computer science information software "
+    "informatics statistics faculty graduate undergraduate course courses "
+    "department university irvine california data systems learning machine "
+    "2020 2021 lab seminar talk ics uci edu professor award project news"
+).split()
+
+
+def make_corpus(pages, seed=0):
+    rand = random.Random(seed)
+    corpus = []
+    for _ in range(pages):
+        paragraphs = "".join(
+            f"<p>{' '.join(rand.choice(WORDS) for _ in range(200))}, "
+            f"don't e-mail (cs-{rand.randint(100, 299)}).</p>"
+            for _ in range(10))
+        corpus.append(
+            f"<html><head><title>page</title><style>p {{}}</style></head>"
+            f"<body>{paragraphs}<script>var x = 1;</script></body></html>")
+    return corpus
+
+
+def load_corpus(html_dir):
+    corpus = []
+    for name in sorted(os.listdir(html_dir)):
+        with open(os.path.join(html_dir, name), "rb") as html_file:
+            corpus.append(html_file.read())
+    return corpus
+
+
+def original_tokenize_words(url, text):
+    # scraper.tokenize_words before the stopword set and compiled patterns
+    words = text.replace("  ", " ").replace("\n", " ").lower().strip()
+    tokens = word_tokenize(words)
+    ftokens = []
+    mh = MinHash(num_perm=128)
+    for t in tokens:
+        if t in stopwords.words():
+            continue
+        if not re.match('[A-Za-z0-9]+', t):
+            continue
+        t2 = re.sub('[^A-Za-z0-9]+', '', t).strip()
+        if len(t2) <= 0:
+            continue
+        ftokens.append(t2)
+        mh.update(t2.encode("utf8"))
+    return ftokens, LeanMinHash(mh)
+
+
+def run(name, tokenize, texts):
+    start = time.perf_counter()
+    count = sum(len(tokenize("", text)[0]) for text in texts)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {count} tokens in {elapsed:.2f}s, "
+          f"{count / elapsed:,.0f} tokens/sec")
+
+
+def main(pages, html_dir, skip_original):
+    corpus = load_corpus(html_dir) if html_dir else make_corpus(pages)
+    texts = [html.document_fromstring(page).text_content() for page in corpus]
+    if not skip_original:
+        run("original", original_tokenize_words, texts)
+    for mode in ("nltk", "regex"):
+        scraper.tokenizer = mode
+        run(mode, scraper.tokenize_words, texts)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--html_dir", type=str, default=None)
+    parser.add_argument(
+        "--skip_original", action="store_true", default=False,
+        help="The original tokenizer takes minutes on large corpora.")
+    args = parser.parse_args()
+    main(args.pages, args.html_dir, args.skip_original)
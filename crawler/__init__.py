@@ -1,11 +1,16 @@
-from utils import get_logger
+from utils import get_logger, logs
+from utils.metrics import metrics
 from crawler.frontier import Frontier
 from crawler.worker import Worker
+from crawler import pipeline
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
+        logs.configure(config.log_level, config.url_log_sample)
         self.logger = get_logger("CRAWLER")
+        if config.metrics:
+            metrics.start(config.metrics_port, config.metrics_file, config.metrics_interval)
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
@@ -24,3 +29,8 @@ class Crawler(object):
     def join(self):
         for worker in self.workers:
             worker.join()
+        pipeline.shutdown()
+        if hasattr(self.frontier, "lock_stats"):
+            self.logger.info(f"Frontier lock contention: {self.frontier.lock_stats()}")
+        metrics.dump()
+        logs.flush()
@@ -0,0 +1,81 @@
+import asyncio
+
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.download import async_download, close_async_pool
+from utils import get_logger
+from utils.logs import URL_LINE
+from scraper import scraper, process_page
+from crawler.pipeline import extract_async
+
+
+class AsyncWorker(Thread):
+    ''' Worker that runs config.async_tasks downloads at once from a single
+    event loop. Scraping runs on an executor thread so it does not stall
+    the loop, with parsing in the parse processes if config.parsers is set. '''
+    def __init__(self, worker_id, config, frontier):
+        self.logger = get_logger(f"AsyncWorker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        super().__init__(daemon=True)
+
+    def run(self):
+        asyncio.run(self._crawl())
+
+    async def _crawl(self):
+        tasks = self.config.async_tasks
+        queue = asyncio.Queue(maxsize=tasks)
+        # The scraper keeps module level state, so it gets one thread.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            await asyncio.gather(
+                self._dispatch(queue, tasks),
+                *(self._fetch(queue, executor) for _ in range(tasks)))
+        close_async_pool()
+        self.logger.info("Frontier is empty. Stopping Crawler.")
+
+    async def _dispatch(self, queue, tasks):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait in a thread for the frontier so the loop keeps running.
+            tbd_url = await loop.run_in_executor(
+                None, self.frontier.get_tbd_url, 1)
+            if tbd_url:
+                await queue.put(tbd_url)
+            elif self.frontier.done():
+                break
+        for _ in range(tasks):
+            await queue.put(None)
+
+    async def _fetch(self, queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            tbd_url = await queue.get()
+            if not tbd_url:
+                break
+            try:
+                resp = await async_download(tbd_url, self.config, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.", extra=URL_LINE)
+                if self.config.parsers <= 0:
+                    await loop.run_in_executor(
+                        executor, self._process, tbd_url, resp)
+                else:
+                    page = await extract_async(tbd_url, resp, self.config)
+                    await loop.run_in_executor(
+                        executor, self._merge, tbd_url, page)
+            except Exception:
+                self.logger.exception(f"Failed to process {tbd_url}.")
+            finally:
+                # Once per url, whether it failed or not. Marking it twice
+                # would release its host while another fetch may be running.
+                self.frontier.mark_url_complete(tbd_url)
+
+    def _process(self, tbd_url, resp):
+        for scraped_url in scraper(tbd_url, resp):
+            self.frontier.add_url(scraped_url)
+
+    def _merge(self, tbd_url, page):
+        for scraped_url in process_page(tbd_url, page):
+            self.frontier.add_url(scraped_url)
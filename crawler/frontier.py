@@ -1,72 +1,262 @@
-import os
-import shelve
+import time
+import heapq
 
-from threading import Thread, RLock
-from queue import Queue, Empty
+from threading import Condition
+from urllib.parse import urlparse
 
 from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
+from utils.locks import TimedLock, StripedSet
+from utils.compact import FingerprintTable, PackedQueue, pack_url, unpack_url
+from utils import canonical
+from utils.metrics import metrics
+from scraper import is_valid, is_low_value, start_recrawl
+from crawler.journal import Journal
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
+        # Guards the host queues, woken when a url may have become ready.
+        self.lock = TimedLock()
+        self.has_work = Condition(self.lock)
+        # Urls to be downloaded, one queue per host. Urls of patterns that
+        # mostly yielded junk wait in a second queue, used once the first
+        # is empty.
+        self.host_queues = dict()
+        self.low_queues = dict()
+        # Heap of (ready time, host) for hosts with queued urls that are
+        # not being downloaded from right now.
+        self.ready_hosts = list()
+        # Hosts that have a url being downloaded.
+        self.busy_hosts = set()
+        # Earliest time each host may be downloaded from again.
+        self.next_fetch = dict()
+        # Hashes of every url discovered so far. In compact mode they are
+        # kept as 64-bit fingerprints and queued urls as packed bytes.
+        self.compact = config.compact
+        self.seen = StripedSet(
+            factory=FingerprintTable if self.compact else set)
+        # Urls are canonicalized before they are hashed, so every address
+        # of a page is crawled once.
+        canonical.configure(keep_params=config.keep_params)
+        metrics.gauge("frontier", self.queue_depths)
         
-        if not os.path.exists(self.config.save_file) and not restart:
+        if not Journal.files(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
+        elif Journal.files(self.config.save_file) and (restart or config.recrawl):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            Journal.remove_files(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.journal = Journal(
+            self.config.save_file, self.config.commit_size,
+            self.config.commit_interval, self.config.compact_size,
+            tag=canonical.canonicalizer.signature)
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
+        elif config.recrawl:
+            self._queue_recrawl(start_recrawl())
+            for url in self.config.seed_urls:
+                self.add_url(url)
         else:
             # Set the frontier state with contents of save file.
             self._parse_save_file()
-            if not self.save:
+            if not self.seen:
                 for url in self.config.seed_urls:
                     self.add_url(url)
 
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
-        total_count = len(self.save)
+        if self.journal.has_checkpoint():
+            self._load_checkpoint()
+            return
+        state = self.journal.load()
+        # Saved urls are canonicalized again, since the rules may have
+        # changed since they were saved. Urls that now share a canonical
+        # form are complete if any of them is.
+        pending = dict()
+        for url, completed in state.values():
+            url = normalize(url)
+            pending[url] = pending.get(url, False) or completed
+        total_count = len(pending)
         tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        # The next restart reads the canonical urls from a checkpoint.
+        urlhashes = list(state)
+        checkpoint = list()
+        for url, completed in pending.items():
+            urlhash = get_urlhash(url)
+            self.seen.add(urlhash)
+            urlhashes.append(urlhash)
+            if not completed:
+                checkpoint.append((urlhash, url))
+                if is_valid(url):
+                    self._push_url(url)
+                    tbd_count += 1
+        self.journal.write_checkpoint(urlhashes, checkpoint)
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
             f"total urls discovered.")
 
-    def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+    def _load_checkpoint(self):
+        ''' Queues the pending urls of the checkpoint, which were saved in
+        canonical form by this version of the rules. Their fingerprints stay
+        on disk, and urls are checked with is_valid when they are popped, so
+        this takes time in the pending urls only. '''
+        seen, changes, pending = self.journal.load_checkpoint()
+        self.seen = StripedSet(
+            factory=FingerprintTable if self.compact else set, base=seen)
+        tbd_count = 0
+        for urlhash, (url, completed) in changes.items():
+            self.seen.add(urlhash)
+            if not completed:
+                self._push_url(url)
+                tbd_count += 1
+        for urlhash, url in pending:
+            self._push_url(url)
+            tbd_count += 1
+        self.logger.info(
+            f"Found {tbd_count} urls to be downloaded from {len(self.seen)} "
+            f"total urls discovered, from the checkpoint.")
+
+    def _queue_recrawl(self, urls):
+        ''' Queues the (url, chance it changed) of earlier crawls, given most
+        likely changed first. Each host downloads its last queued url first,
+        so they are queued in reverse. '''
+        for url, odds in reversed(urls):
+            self.add_url(url)
+        self.logger.info(f"Queued {len(urls)} urls of earlier crawls to recrawl.")
+
+    def _push_url(self, url):
+        host = get_host(url)
+        queues = self.low_queues if is_low_value(url) else self.host_queues
+        queue = queues.get(host)
+        if queue is None:
+            queue = queues[host] = PackedQueue() if self.compact else list()
+        queue.append(pack_url(host, url) if self.compact else url)
+        if self._queued(host) == 1 and host not in self.busy_hosts:
+            # Host had nothing queued, schedule it once its politeness
+            # window has passed.
+            heapq.heappush(
+                self.ready_hosts, (self.next_fetch.get(host, 0), host))
+
+    def get_tbd_url(self, timeout=None):
+        ''' Blocks until a url of a host whose politeness window has passed
+        is available. Returns None once nothing is queued or being
+        downloaded, or if timeout seconds pass without a url. '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self.has_work:
+            while True:
+                now = time.time()
+                if self.ready_hosts and self.ready_hosts[0][0] <= now:
+                    # Only the pop is timed, waiting is timed apart.
+                    with metrics.timer("frontier_pop"):
+                        url = self._pop_url()
+                    if url is not None:
+                        return url
+                    continue
+                if self._finished():
+                    self.has_work.notify_all()
+                    return None
+                # Wait for the first host to cool down, or for other
+                # workers to add urls or release their hosts.
+                wait = self.ready_hosts[0][0] - now if self.ready_hosts else None
+                if deadline is not None:
+                    if deadline <= now:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                with metrics.timer("frontier_wait"):
+                    self.has_work.wait(wait)
+
+    def done(self):
+        ''' True once nothing is queued or being downloaded. '''
+        with self.has_work:
+            return self._finished()
+
+    def _finished(self):
+        return not self.ready_hosts and not self.busy_hosts
+
+    def _queued(self, host):
+        return (len(self.host_queues.get(host, ()))
+                + len(self.low_queues.get(host, ())))
+
+    def _pop_url(self):
+        ''' Returns the next url of the first ready host, or None if every
+        url it had queued turned out to be a trap. '''
+        ready_time, host = heapq.heappop(self.ready_hosts)
+        while self._queued(host):
+            queues = (
+                self.host_queues if host in self.host_queues
+                else self.low_queues)
+            queue = queues[host]
+            url = queue.pop()
+            if not queue:
+                del queues[host]
+            if self.compact:
+                url = unpack_url(host, url)
+            if is_valid(url):
+                self.busy_hosts.add(host)
+                return url
+            # Its pattern was blocked as a trap after it was queued.
+            self.journal.append(get_urlhash(url), url, True)
+        return None
 
     def add_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
+        with metrics.timer("frontier_add"):
+            url = normalize(url)
+            urlhash = get_urlhash(url)
+            if self.seen.add(urlhash):
+                self.journal.append(urlhash, url, False)
+                with self.has_work:
+                    self._push_url(url)
+                    self.has_work.notify()
     
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
-        if urlhash not in self.save:
+        if urlhash not in self.seen:
             # This should not happen.
             self.logger.error(
                 f"Completed url {url}, but have not seen it before.")
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+        self.journal.append(urlhash, url, True)
+        with self.has_work:
+            self._release_host(get_host(url))
+
+    def _release_host(self, host):
+        if host not in self.busy_hosts:
+            return
+        self.busy_hosts.remove(host)
+        # Politeness is per host, counted from the end of the last download.
+        self.next_fetch[host] = time.time() + self.config.time_delay
+        if self._queued(host):
+            heapq.heappush(
+                self.ready_hosts, (self.next_fetch[host], host))
+            self.has_work.notify()
+        elif self._finished():
+            # Wake every waiting worker so they can stop.
+            self.has_work.notify_all()
+
+    def queue_depths(self):
+        with self.has_work:
+            hosts = set(self.host_queues) | set(self.low_queues)
+            return {
+                "queued_urls": sum(self._queued(host) for host in hosts),
+                "queued_hosts": len(hosts),
+                "ready_hosts": len(self.ready_hosts),
+                "busy_hosts": len(self.busy_hosts)}
+
+    def lock_stats(self):
+        return {
+            "frontier_acquired": self.lock.acquired,
+            "frontier_contended": self.lock.contended,
+            "frontier_wait_time": self.lock.wait_time,
+            "seen_contended": self.seen.contended,
+            "seen_wait_time": self.seen.wait_time}
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
@@ -0,0 +1,246 @@
+import os
+import json
+import glob
+import time
+import heapq
+import atexit
+
+from threading import Thread, Lock, Event
+
+from utils.metrics import metrics
+from utils.store import open_shelf
+from utils.compact import FingerprintRun, get_fingerprint
+
+
+class Journal(object):
+    ''' Write-behind persistence for the frontier.
+
+    State changes are appended to a log as (urlhash, completed, url) records.
+    Records are group committed every commit_size records or commit_interval
+    seconds, so a crash loses at most the last commit window. Once the log
+    holds compact_size records it is rotated and folded into the shelve
+    snapshot by a background thread.
+
+    Each fold also brings a checkpoint of the snapshot up to date: the
+    sorted 64-bit fingerprints of every url hash in SAVE.seen.N, and the
+    urls not completed yet in SAVE.pending.N. SAVE.checkpoint names the
+    current generation N and the tag, such as the canonicalization rules,
+    the checkpoint was made under. A restart maps the fingerprints and reads
+    the pending urls and the log, instead of scanning the snapshot. '''
+    def __init__(self, save_file, commit_size, commit_interval, compact_size, tag=""):
+        self.save_file = save_file
+        self.log_file = f"{save_file}.log"
+        self.old_log_file = f"{save_file}.log.old"
+        self.checkpoint_file = f"{save_file}.checkpoint"
+        self.tag = tag
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.compact_size = compact_size
+        self.lock = Lock()
+        # Records that have not been committed yet.
+        self.buffer = list()
+        # Committed records in the current log.
+        self.log_count = 0
+        self.last_commit = time.time()
+        self.compactor = None
+        # Opened when first read or folded into, since some dbm modules
+        # read their whole index when they are opened.
+        self._snapshot = None
+        # generation and tag of the checkpoint, None until one is written
+        self.checkpoint = None
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, "r", encoding="utf-8") as checkpoint_file:
+                self.checkpoint = json.load(checkpoint_file)
+        # A previous run stopped during compaction, finish it first.
+        if os.path.exists(self.old_log_file):
+            self._fold(self.old_log_file)
+        self.log = open(self.log_file, "a", encoding="utf-8")
+        self.closed = Event()
+        Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def files(save_file):
+        ''' Paths of the snapshot, logs and checkpoint of a save file. The
+        snapshot is several files with some dbm modules. '''
+        return [
+            path for path in glob.glob(f"{glob.escape(save_file)}*")
+            if os.path.isfile(path)]
+
+    @staticmethod
+    def remove_files(save_file):
+        for path in Journal.files(save_file):
+            os.remove(path)
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = open_shelf(self.save_file)
+        return self._snapshot
+
+    def load(self):
+        ''' Returns {urlhash: (url, completed)} from the snapshot and log. '''
+        state = dict(self.snapshot.items())
+        for urlhash, url, completed in self._read_log(self.log_file):
+            state[urlhash] = (url, completed)
+        return state
+
+    def has_checkpoint(self):
+        ''' True if a checkpoint made under the current tag exists. '''
+        return self.checkpoint is not None and self.checkpoint["tag"] == self.tag
+
+    def load_checkpoint(self):
+        ''' Returns the fingerprints of the url hashes in the checkpoint, the
+        {urlhash: (url, completed)} changes logged since, and an iterator of
+        the (urlhash, url) of the other urls still to be downloaded. Costs
+        time in the pending urls and the log, not in the urls seen. '''
+        generation = self.checkpoint["generation"]
+        seen = FingerprintRun.open(self._segment("seen", generation))
+        changes = {
+            urlhash: (url, completed)
+            for urlhash, url, completed in self._read_log(self.log_file)}
+        pending = (
+            (urlhash, url)
+            for urlhash, url in self._read_pending(generation)
+            if urlhash not in changes)
+        return seen, changes, pending
+
+    def write_checkpoint(self, urlhashes, pending):
+        ''' Makes a checkpoint under the current tag of the given url hashes
+        and (urlhash, url) pending urls, for saves that have none or were
+        made under another tag. The log is folded first, since it may hold
+        urls saved under the other tag. '''
+        with self.lock:
+            self._commit()
+            if self.compactor:
+                self.compactor.join()
+            self._rotate()
+            self.compactor.join()
+            self._save_checkpoint(
+                sorted({get_fingerprint(urlhash) for urlhash in urlhashes}),
+                pending, self.tag)
+
+    def append(self, urlhash, url, completed):
+        with self.lock:
+            self.buffer.append(f"{urlhash}\t{int(completed)}\t{url}\n")
+            if (len(self.buffer) >= self.commit_size
+                    or time.time() - self.last_commit >= self.commit_interval):
+                self._commit()
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        with self.lock:
+            self._commit()
+            self.log.close()
+        if self.compactor:
+            self.compactor.join()
+        if self._snapshot is not None:
+            self._snapshot.close()
+
+    def _commit(self):
+        # Must be called with self.lock held.
+        self.last_commit = time.time()
+        if not self.buffer:
+            return
+        with metrics.timer("journal_commit"):
+            self.log.write("".join(self.buffer))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+        self.log_count += len(self.buffer)
+        self.buffer.clear()
+        if (self.log_count >= self.compact_size
+                and not (self.compactor and self.compactor.is_alive())):
+            self._rotate()
+
+    def _rotate(self):
+        # Must be called with self.lock held.
+        self.log.close()
+        os.replace(self.log_file, self.old_log_file)
+        self.log = open(self.log_file, "a", encoding="utf-8")
+        self.log_count = 0
+        self.compactor = Thread(
+            target=self._fold, args=(self.old_log_file,), daemon=True)
+        self.compactor.start()
+
+    def _fold(self, log_file):
+        with metrics.timer("journal_fold"):
+            changes = dict()
+            for urlhash, url, completed in self._read_log(log_file):
+                self.snapshot[urlhash] = (url, completed)
+                changes[urlhash] = (url, completed)
+            self.snapshot.sync()
+            if self.has_checkpoint():
+                self._update_checkpoint(changes)
+        os.remove(log_file)
+
+    def _update_checkpoint(self, changes):
+        ''' Writes the next generation of the checkpoint with the changes of
+        a folded log. Folding a log again gives the same checkpoint, so a
+        crash before the log is removed does no harm. '''
+        generation = self.checkpoint["generation"]
+        seen = FingerprintRun.open(self._segment("seen", generation))
+        added = sorted({
+            get_fingerprint(urlhash) for urlhash in changes
+            if urlhash not in seen})
+        pending = [
+            (urlhash, url) for urlhash, url in self._read_pending(generation)
+            if urlhash not in changes]
+        pending.extend(
+            (urlhash, url) for urlhash, (url, completed) in changes.items()
+            if not completed)
+        self._save_checkpoint(
+            heapq.merge(seen, added), pending, self.checkpoint["tag"])
+
+    def _save_checkpoint(self, fingerprints, pending, tag):
+        # Segments of a new generation are written before the checkpoint
+        # file names them, so a crash leaves the last one in place.
+        old = self.checkpoint
+        generation = old["generation"] + 1 if old else 0
+        FingerprintRun.write(self._segment("seen", generation), fingerprints)
+        with open(self._segment("pending", generation), "w", encoding="utf-8") as pending_file:
+            pending_file.writelines(f"{urlhash}\t{url}\n" for urlhash, url in pending)
+            pending_file.flush()
+            os.fsync(pending_file.fileno())
+        checkpoint = {"generation": generation, "tag": tag}
+        temp_file = f"{self.checkpoint_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_file, self.checkpoint_file)
+        self.checkpoint = checkpoint
+        if old:
+            for name in ("seen", "pending"):
+                try:
+                    os.remove(self._segment(name, old["generation"]))
+                except OSError:
+                    # Still mapped by the frontier on some platforms.
+                    pass
+
+    def _segment(self, name, generation):
+        return f"{self.save_file}.{name}.{generation}"
+
+    def _read_pending(self, generation):
+        with open(self._segment("pending", generation), "r", encoding="utf-8") as pending_file:
+            for line in pending_file:
+                urlhash, url = line.rstrip("\n").split("\t", 1)
+                yield urlhash, url
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.commit_interval):
+            with self.lock:
+                if not self.closed.is_set():
+                    self._commit()
+
+    @staticmethod
+    def _read_log(log_file):
+        if not os.path.exists(log_file):
+            return
+        with open(log_file, "r", encoding="utf-8") as log:
+            for line in log:
+                # A torn record at the end of the log is from a crash
+                # during a commit, skip it.
+                if not line.endswith("\n"):
+                    break
+                urlhash, completed, url = line.rstrip("\n").split("\t", 2)
+                yield urlhash, url, completed == "1"
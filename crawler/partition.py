@@ -0,0 +1,307 @@
+import os
+import json
+import shutil
+import time
+import multiprocessing
+
+from queue import Empty
+from hashlib import sha256
+from threading import Thread, Event, Lock
+from configparser import ConfigParser
+
+import scraper
+from utils import get_logger, normalize
+from utils.config import Config
+from utils.analytics import Analytics
+from utils.lsh_index import NearDuplicateIndex
+from utils.content_index import ContentIndex
+from utils.history import FetchHistory
+from crawler import Crawler
+from crawler.frontier import get_host
+
+# Folder the partitions keep their state in, one subfolder each.
+PARTITION_DIR = "partitions"
+# File in PARTITION_DIR with the number of partitions its folders are for.
+COUNT_FILE = "count"
+# Folder in PARTITION_DIR with the statistics the main folder had before the
+# first partitioned run, which the merge adds to those of the partitions.
+BASE_DIR = "base"
+
+
+def get_partition(url, partitions):
+    ''' Partition that owns the host of a normalized url. '''
+    digest = sha256(get_host(url).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) % partitions
+
+
+class PartitionFrontier(object):
+    ''' Frontier of one partition of a crawl split over processes by host.
+
+    Urls of hosts this partition owns go to its own frontier, the others
+    are batched and forwarded to the inbox of their partition. The
+    partition reports itself idle once its frontier is done and nothing is
+    waiting to be forwarded; the crawl stops when the coordinator sees every
+    partition idle with every forwarded url received. '''
+    def __init__(self, frontier, index, inboxes, idle, sent, received, stop,
+                 batch_size=100, flush_interval=0.2):
+        self.frontier = frontier
+        self.index = index
+        self.inboxes = inboxes
+        self.idle = idle
+        self.sent = sent
+        self.received = received
+        self.stop = stop
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Urls waiting to be forwarded, one batch per partition.
+        self.outboxes = [list() for _ in inboxes]
+        # Guards the outboxes and orders the idle flag with received urls.
+        self.lock = Lock()
+        self.arrived = Event()
+        Thread(target=self._receive, daemon=True).start()
+        Thread(target=self._flush_loop, daemon=True).start()
+
+    def add_url(self, url):
+        url = normalize(url)
+        owner = get_partition(url, len(self.inboxes))
+        if owner == self.index:
+            self.frontier.add_url(url)
+            return
+        with self.lock:
+            self.outboxes[owner].append(url)
+            if len(self.outboxes[owner]) >= self.batch_size:
+                self._send(owner)
+
+    def get_tbd_url(self, timeout=None):
+        ''' Blocks until the own frontier has a url. Returns None once the
+        whole crawl is done, or if timeout seconds pass without a url. '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = 0.5 if deadline is None else max(0, min(0.5, deadline - time.time()))
+            tbd_url = self.frontier.get_tbd_url(wait)
+            if tbd_url:
+                return tbd_url
+            if self.stop.is_set():
+                return None
+            with self.lock:
+                for owner in range(len(self.outboxes)):
+                    self._send(owner)
+                if self.frontier.done():
+                    self.idle[self.index] = 1
+            if deadline is not None and time.time() >= deadline:
+                return None
+            # The own frontier is done, wait for urls from other partitions.
+            self.arrived.wait(0.5)
+            self.arrived.clear()
+
+    def done(self):
+        return self.stop.is_set()
+
+    def mark_url_complete(self, url):
+        self.frontier.mark_url_complete(url)
+
+    def lock_stats(self):
+        return self.frontier.lock_stats()
+
+    def _send(self, owner):
+        # Must be called with self.lock held. Counted as sent before it is
+        # put, so a batch in flight always keeps the crawl running.
+        batch = self.outboxes[owner]
+        if not batch:
+            return
+        self.outboxes[owner] = list()
+        self.sent[self.index] += len(batch)
+        self.inboxes[owner].put(batch)
+
+    def _flush_loop(self):
+        while not self.stop.wait(self.flush_interval):
+            with self.lock:
+                for owner in range(len(self.outboxes)):
+                    self._send(owner)
+
+    def _receive(self):
+        inbox = self.inboxes[self.index]
+        while not self.stop.is_set():
+            try:
+                batch = inbox.get(timeout=0.5)
+            except Empty:
+                continue
+            with self.lock:
+                for url in batch:
+                    self.frontier.add_url(url)
+                self.idle[self.index] = 0
+                self.received[self.index] += len(batch)
+            self.arrived.set()
+
+
+def run_partition(index, partitions, config_file, restart, frontier_factory,
+                  worker_factory, cache_server, recrawl, inboxes, idle, sent, received, stop):
+    ''' Crawls one partition in its own folder, started in a child process. '''
+    # Batches left in the inboxes when a crawl is stopped early must not
+    # keep the process from exiting.
+    for inbox in inboxes:
+        inbox.cancel_join_thread()
+    path = os.path.join(PARTITION_DIR, str(index))
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    config = Config(cparser)
+    config.cache_server = cache_server
+    config.recrawl = recrawl
+    if config.metrics_port:
+        config.metrics_port += index + 1
+    config.seed_urls = [
+        url for url in config.seed_urls
+        if get_partition(normalize(url), partitions) == index]
+
+    def partition_frontier(config, restart):
+        return PartitionFrontier(
+            frontier_factory(config, restart), index, inboxes, idle, sent,
+            received, stop)
+
+    crawler = Crawler(
+        config, restart, frontier_factory=partition_frontier,
+        worker_factory=worker_factory)
+    crawler.start()
+    if scraper.initialized:
+        scraper.write_data()
+        scraper.lsh.close()
+        scraper.content_index.close()
+        scraper.history.close()
+
+
+class PartitionedCrawler(object):
+    ''' Runs a crawl in one process per partition of the hosts, and merges
+    the statistics, duplicate indexes and fetch histories of the partitions
+    when it is done. '''
+    def __init__(self, config_file, config, restart, partitions,
+                 frontier_factory, worker_factory, check_interval=1):
+        self.config_file = os.path.abspath(config_file)
+        self.config = config
+        self.restart = restart
+        self.partitions = partitions
+        self.frontier_factory = frontier_factory
+        self.worker_factory = worker_factory
+        self.check_interval = check_interval
+        self.logger = get_logger("CRAWLER")
+        self.processes = list()
+
+    def prepare(self):
+        ''' Checks that the partition folders are for this number of
+        partitions, since their urls and pages are split by it. The first
+        run writes the number and keeps the statistics of the main folder. '''
+        count_path = os.path.join(PARTITION_DIR, COUNT_FILE)
+        if os.path.exists(count_path):
+            with open(count_path) as count_file:
+                count = int(count_file.read())
+        else:
+            # folders of a crawl from before the number was kept
+            count = sum(1 for name in os.listdir(PARTITION_DIR) if name.isdigit()) \
+                if os.path.isdir(PARTITION_DIR) else 0
+        if count and count != self.partitions:
+            raise RuntimeError(
+                f"{PARTITION_DIR} holds a crawl split over {count} partitions, "
+                f"run it with {count} partitions or move {PARTITION_DIR} away.")
+        if not count:
+            # the main folder has no merged statistics yet, only those of
+            # an unpartitioned crawl if any
+            base = os.path.join(PARTITION_DIR, BASE_DIR)
+            os.makedirs(base, exist_ok=True)
+            for name in (scraper.analytics_log_path, scraper.analytics_path):
+                if os.path.exists(name):
+                    shutil.copy(name, os.path.join(base, name))
+        if not os.path.exists(count_path):
+            os.makedirs(PARTITION_DIR, exist_ok=True)
+            with open(count_path, "w") as count_file:
+                count_file.write(str(self.partitions))
+
+    def start(self):
+        self.prepare()
+        # Spawned, so the children do not inherit the parent's threads.
+        context = multiprocessing.get_context("spawn")
+        self.inboxes = [context.Queue() for _ in range(self.partitions)]
+        self.idle = context.Array("b", self.partitions)
+        self.sent = context.Array("q", self.partitions)
+        self.received = context.Array("q", self.partitions)
+        self.stop = context.Event()
+        self.processes = [
+            context.Process(target=run_partition, args=(
+                index, self.partitions, self.config_file, self.restart,
+                self.frontier_factory, self.worker_factory,
+                self.config.cache_server, self.config.recrawl, self.inboxes,
+                self.idle, self.sent, self.received, self.stop))
+            for index in range(self.partitions)]
+        for process in self.processes:
+            process.start()
+        self.join()
+
+    def join(self):
+        last = None
+        while any(process.is_alive() for process in self.processes):
+            time.sleep(self.check_interval)
+            if any(process.exitcode for process in self.processes):
+                self.logger.error("A partition failed, stopping the crawl.")
+                self.stop.set()
+            # Done once every partition was idle with every forwarded url
+            # received in two checks in a row with nothing sent in between.
+            state = (list(self.idle), sum(self.sent), sum(self.received))
+            if all(state[0]) and state[1] == state[2] and state == last:
+                self.stop.set()
+            last = state
+        self.logger.info(
+            f"Partitions done, forwarded {sum(self.sent)} urls. Merging data.")
+        self.merge()
+
+    def merge(self):
+        ''' Merges the statistics, duplicate indexes and fetch histories of
+        the partitions into the files of an unpartitioned crawl. The
+        statistics the main folder had before the first partitioned run are
+        added to them, the indexes and histories are merged into its files. '''
+        analytics = Analytics(
+            scraper.analytics_log_path, scraper.analytics_path,
+            top_size=50, fold_size=scraper.analytics_fold,
+            pages_path=scraper.analytics_pages_path)
+        base_path = os.path.join(PARTITION_DIR, BASE_DIR)
+        # its pages are in the page store of the main folder already
+        base = Analytics(
+            os.path.join(base_path, scraper.analytics_log_path),
+            os.path.join(base_path, scraper.analytics_path))
+        base.load()
+        analytics.merge(base)
+        base.close()
+        lsh = NearDuplicateIndex(
+            scraper.hash_path, threshold=0.75, num_perm=128,
+            shards=scraper.hash_shards, by_host=scraper.hash_by_host)
+        content_index = ContentIndex(scraper.content_path, scraper.simhash_distance)
+        history = FetchHistory(scraper.history_path)
+        for index in range(self.partitions):
+            path = os.path.join(PARTITION_DIR, str(index))
+            partition = Analytics(
+                os.path.join(path, scraper.analytics_log_path),
+                os.path.join(path, scraper.analytics_path),
+                pages_path=os.path.join(path, scraper.analytics_pages_path))
+            partition.load()
+            analytics.merge(partition)
+            partition.close()
+            partition_lsh = NearDuplicateIndex(
+                os.path.join(path, scraper.hash_path), threshold=0.75,
+                num_perm=128, shards=scraper.hash_shards,
+                by_host=scraper.hash_by_host)
+            lsh.merge(partition_lsh)
+            partition_lsh.close()
+            partition_content = ContentIndex(
+                os.path.join(path, scraper.content_path), scraper.simhash_distance)
+            content_index.merge(partition_content)
+            partition_content.close()
+            partition_history = FetchHistory(os.path.join(path, scraper.history_path))
+            history.merge(partition_history)
+            partition_history.close()
+        analytics.fold()
+        report = analytics.report()
+        analytics.close()
+        lsh.close()
+        content_index.close()
+        history.close()
+        with open(scraper.data_path, "w") as data_file:
+            json.dump(report, data_file, indent=4)
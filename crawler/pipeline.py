@@ -0,0 +1,98 @@
+import asyncio
+import multiprocessing
+
+from threading import Lock
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.metrics import metrics
+from scraper import scraper, page_source, unchanged_page, extract_page, process_page
+
+# Pool of parse processes shared by all workers, None if parsing runs in
+# the worker threads.
+parse_pool = None
+parse_pool_lock = Lock()
+
+
+def get_parse_pool(config):
+    global parse_pool
+    if config.parsers <= 0:
+        return None
+    with parse_pool_lock:
+        if parse_pool is None:
+            # Spawn, since forking a process that already runs threads can
+            # leave locks held in the children.
+            parse_pool = ProcessPoolExecutor(
+                max_workers=config.parsers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return parse_pool
+
+
+def reset_parse_pool(broken):
+    ''' Drops a pool one of whose processes died, such as by an OOM kill
+    or an lxml crash. Every later page would fail in it, so the next page
+    starts a new one. '''
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is not broken:
+            # another worker already replaced it
+            return
+        parse_pool = None
+    metrics.count("parse_pool_restarts")
+    broken.shutdown(wait=False)
+
+
+def shutdown():
+    ''' Stops the parse processes once the workers are done. They are not
+    daemons, so a pool left running keeps the process from exiting. '''
+    global parse_pool
+    with parse_pool_lock:
+        pool, parse_pool = parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def submit_page(pool, url, resp):
+    ''' Starts parsing and tokenizing the page in a parse process. Pages a
+    recrawl finds unchanged by their validators are done right away. '''
+    source = page_source(resp)
+    page = unchanged_page(url, *source)
+    if page is not None:
+        done = Future()
+        done.set_result(page)
+        return done
+    return pool.submit(extract_page, url, *source)
+
+
+def extract(url, resp, config):
+    ''' Parses and tokenizes the page in the parse processes. A page whose
+    pool broke is tried once more in a new pool. '''
+    for attempt in range(2):
+        pool = get_parse_pool(config)
+        try:
+            return submit_page(pool, url, resp).result()
+        except BrokenProcessPool:
+            reset_parse_pool(pool)
+            if attempt:
+                raise
+
+
+async def extract_async(url, resp, config):
+    ''' Same as extract, awaited in an event loop. '''
+    for attempt in range(2):
+        pool = get_parse_pool(config)
+        try:
+            return await asyncio.wrap_future(submit_page(pool, url, resp))
+        except BrokenProcessPool:
+            reset_parse_pool(pool)
+            if attempt:
+                raise
+
+
+def scrape(url, resp, config):
+    ''' Same as scraper(url, resp), but the CPU heavy part runs in the parse
+    processes when config.parsers is set. The crawl data is still merged
+    in this process. '''
+    if config.parsers <= 0:
+        return scraper(url, resp)
+    return process_page(url, extract(url, resp, config))
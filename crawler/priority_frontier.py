@@ -0,0 +1,227 @@
+import os
+import math
+import time
+import heapq
+import shutil
+
+from itertools import count
+
+from utils import get_urlhash, normalize
+from utils.metrics import metrics
+from scraper import is_valid, is_low_value, host_stats
+from crawler.frontier import Frontier, get_host
+
+# Weights of the parts of a url's score, higher scores are downloaded first.
+DEPTH_WEIGHT = 1.0
+NOVELTY_WEIGHT = 2.0
+YIELD_WEIGHT = 4.0
+INLINK_WEIGHT = 1.0
+LOW_VALUE_PENALTY = 10.0
+# Weight of the chance that a url changed since an earlier crawl, on a
+# recrawl.
+CHANGE_WEIGHT = 4.0
+# Ready hosts compared when choosing the next url.
+SCAN_HOSTS = 64
+
+
+class PriorityFrontier(Frontier):
+    ''' Frontier that downloads the urls with the highest expected yield
+    first, instead of the last url found on each host.
+
+    A url scores higher the shallower its path, the fewer pages its host has
+    produced so far, the larger the share of its host's pages that were not
+    junk and the more links point to it. Urls of low value patterns are
+    scored last. Each host keeps a heap of its urls, and among the hosts
+    whose politeness window has passed the one with the best url is chosen.
+
+    At most config.priority_heap urls are kept in memory. Beyond that the
+    worst half of the largest host's heap is spilled to a file in
+    SAVE.spill, which is read back once the host's heap is empty. '''
+    def __init__(self, config, restart):
+        self.max_queued = config.priority_heap
+        self.spill_dir = f"{config.save_file}.spill"
+        # Heap entries in memory, including stale ones.
+        self.queued = 0
+        # Urls in the spill file of each host.
+        self.spilled = dict()
+        # urlhash: [inlinks, entry sequence] of urls queued in memory. A url
+        # is pushed again when its score improves, older entries are stale.
+        self.links = dict()
+        self.sequence = count()
+        # Spilled urls are queued again from the save file.
+        if os.path.exists(self.spill_dir):
+            shutil.rmtree(self.spill_dir)
+        os.makedirs(self.spill_dir)
+        super().__init__(config, restart)
+
+    def _score(self, url, inlinks):
+        host = get_host(url)
+        path = url.partition("://")[2].partition("/")[2].partition("?")[0]
+        depth = len([segment for segment in path.split("/") if segment])
+        fetched, junk = host_stats(host)
+        score = (
+            - DEPTH_WEIGHT * depth
+            + NOVELTY_WEIGHT / (1 + fetched)
+            + YIELD_WEIGHT * (fetched - junk + 1) / (fetched + 2)
+            + INLINK_WEIGHT * math.log2(1 + inlinks))
+        if is_low_value(url):
+            score -= LOW_VALUE_PENALTY
+        return score
+
+    def _queue_recrawl(self, urls):
+        ''' Queues the (url, chance it changed) of earlier crawls, scoring
+        the urls likely to have changed higher. '''
+        for url, odds in urls:
+            url = normalize(url)
+            urlhash = get_urlhash(url)
+            if self.seen.add(urlhash):
+                self.journal.append(urlhash, url, False)
+                with self.has_work:
+                    self._push_url(url, urlhash, bonus=CHANGE_WEIGHT * odds)
+        self.logger.info(f"Queued {len(urls)} urls of earlier crawls to recrawl.")
+
+    def _push_url(self, url, urlhash=None, inlinks=1, bonus=0.0):
+        host = get_host(url)
+        if urlhash is None:
+            urlhash = get_urlhash(url)
+        self._push_entry(host, url, urlhash, inlinks, self._score(url, inlinks) + bonus)
+        if self._queued(host) == 1 and host not in self.busy_hosts:
+            heapq.heappush(
+                self.ready_hosts, (self.next_fetch.get(host, 0), host))
+        if self.queued > self.max_queued:
+            self._spill()
+
+    def _push_entry(self, host, url, urlhash, inlinks, score):
+        sequence = next(self.sequence)
+        self.links[urlhash] = [inlinks, sequence]
+        heapq.heappush(
+            self.host_queues.setdefault(host, list()), (-score, sequence, url))
+        self.queued += 1
+
+    def _queued(self, host):
+        return len(self.host_queues.get(host, ())) + self.spilled.get(host, 0)
+
+    def _head(self, host):
+        ''' Negated score of the best url of a host. '''
+        if not self.host_queues.get(host) and self.spilled.get(host):
+            self._reload(host)
+        queue = self.host_queues.get(host)
+        return queue[0][0] if queue else 0
+
+    def _pop_url(self):
+        ''' Returns the best url of the ready hosts, or None if every url the
+        chosen host had queued turned out to be a trap. '''
+        now = time.time()
+        ready = list()
+        while (self.ready_hosts and len(ready) < SCAN_HOSTS
+               and self.ready_hosts[0][0] <= now):
+            ready.append(heapq.heappop(self.ready_hosts))
+        best = min(ready, key=lambda item: self._head(item[1]))
+        for item in ready:
+            if item is not best:
+                heapq.heappush(self.ready_hosts, item)
+        host = best[1]
+        while self._queued(host):
+            if not self.host_queues.get(host):
+                self._reload(host)
+            queue = self.host_queues[host]
+            score, sequence, url = heapq.heappop(queue)
+            self.queued -= 1
+            if not queue:
+                del self.host_queues[host]
+            urlhash = get_urlhash(url)
+            link = self.links.get(urlhash)
+            if link is None or link[1] != sequence:
+                # Stale entry of a url that was pushed again.
+                continue
+            del self.links[urlhash]
+            if is_valid(url):
+                self.busy_hosts.add(host)
+                return url
+            # Its pattern was blocked as a trap after it was queued.
+            self.journal.append(urlhash, url, True)
+        return None
+
+    def add_url(self, url):
+        with metrics.timer("frontier_add"):
+            self._add_url(url)
+
+    def _add_url(self, url):
+        url = normalize(url)
+        urlhash = get_urlhash(url)
+        if self.seen.add(urlhash):
+            self.journal.append(urlhash, url, False)
+            with self.has_work:
+                self._push_url(url, urlhash)
+                self.has_work.notify()
+            return
+        with self.has_work:
+            link = self.links.get(urlhash)
+            if link is None:
+                # Downloaded, being downloaded or spilled.
+                return
+            link[0] += 1
+            # Push it again each time its inlinks double, so its score
+            # follows them without a push per link.
+            if link[0] & (link[0] - 1) == 0:
+                self._push_url(url, urlhash, link[0])
+
+    def queue_depths(self):
+        with self.has_work:
+            # Stale heap entries are not counted.
+            hosts = set(self.host_queues) | set(self.spilled)
+            return {
+                "queued_urls": len(self.links) + sum(self.spilled.values()),
+                "queued_hosts": len(hosts),
+                "spilled_urls": sum(self.spilled.values()),
+                "ready_hosts": len(self.ready_hosts),
+                "busy_hosts": len(self.busy_hosts)}
+
+    def _spill(self):
+        # Spill until a quarter of the heap space is free again, so spills
+        # are not repeated on every push.
+        while self.queued > self.max_queued * 3 // 4:
+            host = max(self.host_queues, key=lambda host: len(self.host_queues[host]))
+            queue = self.host_queues[host]
+            queue.sort()
+            keep = len(queue) // 2
+            spill = queue[keep:]
+            del queue[keep:]
+            if not queue:
+                del self.host_queues[host]
+            self.queued -= len(spill)
+            written = 0
+            with open(self._spill_file(host), "a", encoding="utf-8") as spill_file:
+                for score, sequence, url in spill:
+                    urlhash = get_urlhash(url)
+                    link = self.links.get(urlhash)
+                    if link is None or link[1] != sequence:
+                        continue
+                    del self.links[urlhash]
+                    spill_file.write(f"{-score}\t{link[0]}\t{url}\n")
+                    written += 1
+            if written:
+                self.spilled[host] = self.spilled.get(host, 0) + written
+
+    def _reload(self, host):
+        ''' Moves the best urls of a host's spill file back to its heap. '''
+        path = self._spill_file(host)
+        with open(path, encoding="utf-8") as spill_file:
+            entries = [line.rstrip("\n").split("\t", 2) for line in spill_file]
+        entries.sort(key=lambda entry: float(entry[0]), reverse=True)
+        size = max(1, self.max_queued // 8)
+        rest = entries[size:]
+        del self.spilled[host]
+        if rest:
+            with open(path, "w", encoding="utf-8") as spill_file:
+                spill_file.writelines(f"{score}\t{inlinks}\t{url}\n" for score, inlinks, url in rest)
+            self.spilled[host] = len(rest)
+        else:
+            os.remove(path)
+        # Pushed back without spilling, the heap may go over its size by
+        # one reload.
+        for score, inlinks, url in entries[:size]:
+            self._push_entry(host, url, get_urlhash(url), int(inlinks), float(score))
+
+    def _spill_file(self, host):
+        return os.path.join(self.spill_dir, host.replace(":", "_"))
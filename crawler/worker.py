@@ -2,8 +2,8 @@ from threading import Thread
 
 from utils.download import download
 from utils import get_logger
-from scraper import scraper
-import time
+from utils.logs import URL_LINE
+from crawler.pipeline import scrape
 
 
 class Worker(Thread):
@@ -19,12 +19,16 @@ class Worker(Thread):
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper(tbd_url, resp)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
+            try:
+                resp = download(tbd_url, self.config, self.logger)
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.", extra=URL_LINE)
+                scraped_urls = scrape(tbd_url, resp, self.config)
+                for scraped_url in scraped_urls:
+                    self.frontier.add_url(scraped_url)
+            except Exception:
+                # Still mark the url complete below, otherwise its host
+                # stays busy and the other workers never finish.
+                self.logger.exception(f"Failed to process {tbd_url}.")
             self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
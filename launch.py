@@ -1,17 +1,41 @@
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
-from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.priority_frontier import PriorityFrontier
+from crawler.partition import PartitionedCrawler
+from crawler.worker import Worker
+from crawler.async_worker import AsyncWorker
 
+ENGINES = {"thread": Worker, "async": AsyncWorker}
+FRONTIERS = {"host": Frontier, "priority": PriorityFrontier}
 
-def main(config_file, restart):
+
+def main(config_file, restart, engine="thread", frontier=None, partitions=None,
+         cache_server=None, recrawl=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
-    config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
+    config.recrawl = recrawl
+    if cache_server:
+        # A local cache server such as utils.cache_server, no registration.
+        host, port = cache_server.rsplit(":", 1)
+        config.cache_server = (host, int(port))
+    else:
+        from utils.server_registration import get_cache_server
+        config.cache_server = get_cache_server(config, restart or recrawl)
+    frontier_factory = FRONTIERS[frontier or config.frontier]
+    partitions = partitions or config.partitions
+    if partitions > 1:
+        crawler = PartitionedCrawler(
+            config_file, config, restart, partitions, frontier_factory,
+            ENGINES[engine])
+    else:
+        crawler = Crawler(
+            config, restart, frontier_factory=frontier_factory,
+            worker_factory=ENGINES[engine])
     crawler.start()
 
 
@@ -19,5 +43,13 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="thread")
+    parser.add_argument("--frontier", choices=sorted(FRONTIERS), default=None)
+    parser.add_argument("--partitions", type=int, default=None)
+    parser.add_argument("--cache_server", type=str, default=None,
+                        help="host:port of a local cache server to use instead of registering")
+    parser.add_argument("--recrawl", action="store_true", default=False,
+                        help="crawl the urls fetched before again, most likely changed first")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.engine, args.frontier, args.partitions,
+         args.cache_server, args.recrawl)
@@ -2,19 +2,29 @@ import re
 import pickle
 import json
 # Import lxml library for html page analysis
-from lxml import html
 from lxml.etree import ParseError, ParserError
-from lxml.html.clean import Cleaner
 from urllib.parse import urlparse
-from urllib.parse import urlunparse
+from urllib.parse import urljoin
 import datetime
 import os
+import time
+from threading import Lock
 # Import nltk library for tokenizing
 import nltk
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 # Import datasketch for minhash calculation and index
-from datasketch import MinHash, LeanMinHash, MinHashLSH
+from datasketch import MinHash, LeanMinHash
+from utils.url_filter import UrlFilter
+from utils.canonical import canonicalize
+from utils.traps import TrapDetector
+from utils.metrics import metrics
+from utils.lsh_index import NearDuplicateIndex
+from utils.content_index import ContentIndex, text_fingerprint, simhash
+from utils.history import FetchHistory
+from utils.analytics import Analytics
+from utils.page_parser import parse_page
+from utils.logs import get_file_logger
 
 # you may need to download nltk data in order to make use of the nltk functionality
 nltk.download('stopwords')
@@ -25,6 +35,10 @@ initialized = False
 out_cycle = 10
 # current link count
 out_current = 0
+# guards initialized and out_current, which every worker thread checks
+state_lock = Lock()
+# keeps two threads from writing the data file at once
+data_lock = Lock()
 # domains that are valid to crawl
 valid_domains = "ics.uci.edu|cs.uci.edu|informatics.uci.edu|stat.uci.edu|today.uci.edu/department" \
                 "/information_computer_sciences"
@@ -39,18 +53,39 @@ invalid_types = "css|js|bmp|gif|jpe?g|ico" \
                 "|rm|smil|wmv|swf|wma|zip|rar|gz"
 # invalid paths, these paths have often been found to be useless
 invalid_paths = "calender|wp-json"
+# the rules above compiled into one filter
+url_filter = UrlFilter(valid_domains, invalid_types, invalid_paths)
+# learns which url patterns keep yielding junk pages, these are crawled last and then blocked
+traps = TrapDetector(max_depth=12, max_repeats=2, min_samples=20, low_ratio=0.5, block_ratio=0.9, budget=50)
 # enable logging
 logging = True
-# output file
+# logger of the data file, written by the log writer thread
 output = None
 # data file name
 data_path = "data.json"
-# tokens file name
+# statistics log and snapshot file names
+analytics_log_path = "analytics.log"
+analytics_path = "analytics.pickle"
+# length and token counts of every page counted
+analytics_pages_path = "analytics.pages"
+# after how many pages the statistics log is folded into the snapshot
+analytics_fold = 1000
+# tokens and subdomain file names of older crawls, used to seed the statistics
 token_path = "tokens.pickle"
-# subdomain file name
 subdomain_path = "domains.pickle"
-# hashes file name
-hash_path = "hashes.pickle"
+# minhash index folder name
+hash_path = "hashes"
+# number of files the minhash index is split into
+hash_shards = 4
+# whether near duplicates are only searched for within the same host
+hash_by_host = False
+# text fingerprint folder name, these are checked before a page is tokenized
+content_path = "fingerprints"
+# fetch history file name, the last status, validators and text fingerprint of every url fetched
+history_path = "history.shelve"
+# max bits the SimHashes of two pages may differ in for one to be dropped before tokenizing
+# None turns the SimHash check off, leaving near duplicates to the minhash index
+simhash_distance = None
 # separator string
 separator = "#" * 10 + "\n"
 # min text size of a page to analyze
@@ -59,153 +94,275 @@ min_size = 1e3
 max_size = 2e5
 # min portion(%) of a page that should be text
 min_part = 0.1
+# bytes a pickled response may have on top of its content, larger responses are skipped without decoding them
+response_slack = 1e4
+# content types that are parsed, pages without a content type are parsed too
+html_types = ("text/html", "application/xhtml+xml")
 # used to get list of tokens in a page, commented out for now
 # tokenFile = None
-# dict mapping all tokens to total frequency 
-word_dict = {}
-# List of pages with largest token count
-pages_max = []
-max_len = -1
-# dictionary of subdomains found
-subdomain_dic = {}
-# sorted list of sub-domains
-sorted_domains = []
-# unique page count
-unique_count = 0
-# minhash index
-lsh = MinHashLSH(threshold=0.75, num_perm=128)
+# unique page count, longest pages, word frequencies and subdomains found
+analytics = Analytics(analytics_log_path, analytics_path, top_size=50, fold_size=analytics_fold,
+                      pages_path=analytics_pages_path)
+# minhash index, opened by init
+lsh = None
+# text fingerprints of the pages seen, opened by init
+content_index = None
+# fetch history, opened by init
+history = None
+# whether this is a recrawl, set by start_recrawl
+# pages whose validators did not change since the last crawl are then not parsed, their links are queued already
+recrawl = False
+# tokenizer for page text, "nltk" uses word_tokenize, "regex" splits on non-alphanumeric characters
+# the regex tokenizer is faster but splits contractions and hyphenated words differently
+tokenizer = "nltk"
+# set of stopwords of all languages, loaded on first use
+stop_words = None
+# token patterns, compiled once
+token_start = re.compile('[A-Za-z0-9]+')
+token_junk = re.compile('[^A-Za-z0-9]+')
+regex_token = re.compile('[a-z0-9]+')
 
 
 def scraper(url, resp):
-    # check if initialized
-    # this is used to load data if not --restart
+    source = page_source(resp)
+    page = unchanged_page(url, *source)
+    if page is None:
+        # copies are dropped before tokenizing since the fingerprints are at hand in this process
+        page = extract_page(url, *source, check=check_content)
+    return process_page(url, page)
+
+
+# returns the parts of a response that extract_page needs, these can be sent to another process
+# the content is None for pages that are too large or not html, which are skipped before being decoded or parsed
+# the validators are the (ETag, Last-Modified) headers of the response, None if it has none
+def page_source(resp):
+    if resp.status != 200 or resp.size > max_size + response_slack:
+        return resp.status, None, resp.error, None
+    raw = resp.raw_response
+    if raw is None:
+        return resp.status, None, resp.error, None
+    validators = (raw.headers.get("ETag"), raw.headers.get("Last-Modified"))
+    if validators == (None, None):
+        validators = None
+    content_type = raw.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type and content_type not in html_types:
+        return resp.status, None, resp.error, validators
+    return resp.status, raw.content, resp.error, validators
+
+
+# returns a page as extract_page does, for a page that was not parsed
+def new_page(status, error, validators=None):
+    return {"status": status, "error": error, "validators": validators, "page_size": None, "text_size": None,
+            "links": [], "tokens": None, "minhash": None, "parse_time": None, "tokenize_time": None,
+            "fingerprint": None, "simhash": None, "duplicate": None}
+
+
+# on a recrawl, returns the page unparsed if the response has the validators of the last fetch of the url
+# returns None for pages that have to be parsed
+def unchanged_page(url, status, content, error, validators):
+    if not recrawl or status != 200 or content is None or validators is None:
+        return None
+    record = history.get(url)
+    if record is None or record.status != 200 or record.validators != validators:
+        return None
+    page = new_page(status, error, validators)
+    page["duplicate"] = "unchanged"
+    return page
+
+
+# loads data if not --restart, once for all threads
+def ensure_initialized():
     global initialized
     if not initialized:
-        init()
-        initialized = True
+        with state_lock:
+            # another thread may have initialized it while this one waited
+            if not initialized:
+                init()
+                initialized = True
+
+
+# checks the text fingerprints of a page against the pages seen, and adds them if the page is new
+# returns the dedup tier that found a copy, "unchanged" if the text is the same as when the url was
+# last fetched and None if the page is new
+def check_content(url, fingerprint, simhash_value):
+    ensure_initialized()
+    with metrics.timer("content_check"):
+        record = history.get(url)
+        if record is not None and record.fingerprint == fingerprint:
+            return "unchanged"
+        return content_index.check(fingerprint, simhash_value)
+
+
+# starts a recrawl, returns (url, chance it changed) of every url fetched before, most likely changed first
+def start_recrawl():
+    global recrawl
+    ensure_initialized()
+    recrawl = True
+    return history.recrawl_order()
+
+
+# merges a page analyzed by extract_page into the crawl data, returns the valid links of the page
+# this has to run in the crawler process since it updates the module data
+def process_page(url, page):
+    ensure_initialized()
     # check out_counter
     # output written data ever set amount of cycles
     global out_current
-    if out_current == out_cycle:
+    with state_lock:
+        due = out_current == out_cycle
+        out_current = 0 if due else out_current + 1
+    if due:
         write_data()
-        out_current = 0
-    else:
-        out_current += 1
+    # parse and tokenize times are measured where the page was extracted, which may be a parse process
+    if page.get("parse_time") is not None:
+        metrics.observe("parse", page["parse_time"])
+    if page.get("tokenize_time") is not None:
+        metrics.observe("tokenize", page["tokenize_time"])
     # extract links from given url
-    links = extract_next_links(url, resp)
+    links = extract_next_links(url, page)
+    # remember what this fetch returned, the next fetch of the url is compared with it
+    if page["status"] is not None:
+        history.record(url, page["status"], page["validators"], page["fingerprint"])
     # check if any links were returned
     if not links:
         return list()
+    # resolve the links against the page url and canonicalize them
+    # this lowercases the host, drops default ports, fragments and query parameters
+    # that are not kept, and resolves dot segments and index pages
     urls = []
-    p_url = urlparse(url)
-    # check if each link is valid
-    # modifies some links to make them valid
     for link in links:
-        # parse the url
-        parsed = urlparse(link)
-        # set scheme if not one
-        scheme = parsed.scheme
-        if scheme == "":
-            scheme = p_url.scheme
-        # set netloc if not one
-        netloc = parsed.netloc
-        if netloc == "":
-            netloc = p_url.netloc
-        # reconstruct url
-        link = urlunparse((scheme, netloc, parsed.path, None, None, None))
-        # check if the link is valid
-        if is_valid(link):
-            # append the url with fragment removed
-            urls.append(link)
-    return urls
-
-
-def extract_next_links(url, resp):
-    if resp.status == 200:
-        # get total size of page
-        page_size = len(resp.raw_response.content)
-        # check to see if page is to large, if so skip it
-        if page_size > max_size:
-            return []
-        # convert content into html data
-        parser = html.HTMLParser(remove_blank_text=True)
         try:
-            data = html.document_fromstring(resp.raw_response.content, parser)
-            # clean the document
-            cleaner = Cleaner(style=True)
-            cleaned = cleaner.clean_html(data)
-            text = cleaned.text_content()
-        except (ParseError, ParserError, UnicodeDecodeError):
-            return list()
-        text_size = len(text)
+            urls.append(canonicalize(urljoin(url, link)))
+        except ValueError:
+            # malformed link, such as a bad ipv6 host
+            continue
+    # check the links of the page at once, then drop links into traps
+    return [link for link in url_filter.filter_urls(urls) if not traps.is_trap(link)]
+
+
+# parses and tokenizes a page, does not touch any module data so it can run in a parse process
+# returns a dict with the links, tokens, minhash, text fingerprints and size stats of the page
+# check is called with the fingerprints before tokenizing, a page it finds a copy for is not tokenized
+# duplicate is the tier that found a copy, False for a new page and None if the page was not checked
+def extract_page(url, status, content, error, validators=None, check=None):
+    page = new_page(status, error, validators)
+    # page was not downloaded, or skipped by page_source
+    if status != 200 or content is None:
+        return page
+    # get total size of page
+    page_size = len(content)
+    page["page_size"] = page_size
+    # check to see if page is to large, if so skip it
+    if page_size > max_size:
+        return page
+    # get the visible text and the links of the page in one pass
+    # parsing stops early once the page can no longer have enough text
+    start = time.perf_counter()
+    try:
+        text, links, complete = parse_page(content, max(min_size, min_part * page_size))
+    except (ParseError, ParserError, UnicodeDecodeError):
+        return page
+    page["parse_time"] = time.perf_counter() - start
+    text_size = len(text)
+    page["text_size"] = text_size
+    # check if enough text content exists on page
+    # if not skip analysis of this page
+    if not complete or text_size < min_size or text_size / page_size < min_part:
+        return page
+    # all the links in the page
+    page["links"] = links
+    # fingerprint the text, which is much cheaper than tokenizing it
+    page["fingerprint"] = text_fingerprint(text)
+    if simhash_distance is not None:
+        page["simhash"] = simhash(text)
+    if check is not None:
+        page["duplicate"] = check(url, page["fingerprint"], page["simhash"]) or False
+        if page["duplicate"]:
+            return page
+    # tokenize the text on the page
+    start = time.perf_counter()
+    page["tokens"], page["minhash"] = tokenize_words(url, text)
+    page["tokenize_time"] = time.perf_counter() - start
+    return page
+
+
+def extract_next_links(url, page):
+    if page["status"] == 200:
+        # pages parsed in a parse process are checked here, before the minhash index
+        if page["duplicate"] is None and page["fingerprint"] is not None:
+            page["duplicate"] = check_content(url, page["fingerprint"], page["simhash"]) or False
+        # page did not change since it was last fetched, it is not analyzed again
+        # its links are returned if it was parsed, they may have changed while its text did not
+        if page["duplicate"] == "unchanged":
+            traps.record(url, False)
+            metrics.count("pages_unchanged")
+            metrics.count("unchanged_validators" if page["text_size"] is None else "unchanged_text")
+            return page["links"]
+        # page was too large or could not be parsed
+        if page["text_size"] is None:
+            traps.record(url, True)
+            return []
         # log the link
-        log(f"{resp.status} - {url} - {text_size}/{page_size}\n")
-        # check if enough text content exists on page
-        # if not skip analysis of this page
-        if text_size < min_size or text_size / page_size < min_part:
+        log(f"{page['status']} - {url} - {page['text_size']}/{page['page_size']}\n")
+        # page is a copy of a page seen, it was not tokenized
+        if page["duplicate"]:
+            traps.record(url, True)
+            metrics.count("pages_duplicate")
+            metrics.count(f"dedup_{page['duplicate']}")
+            return list()
+        # page did not have enough text to analyze
+        if page["tokens"] is None:
+            traps.record(url, True)
             return []
-        # tokenize the text on the page
-        tk, lmh = tokenize_words(url, text)
-        # check if similar pages exist
-        global lsh
-        sim = lsh.query(lmh)
+        tk, lmh = page["tokens"], page["minhash"]
+        # check if similar pages exist, and index the page if not
+        # this is one step, so two threads can not both keep copies of a page
+        # a page that changed since its last fetch is not a copy of its last version
+        p_url = urlparse(url)
+        with metrics.timer("lsh_insert_unique"):
+            sim = lsh.insert_unique(url, lmh, p_url.netloc)
         # if similar pages exist above threshold
         if sim:
+            traps.record(url, True)
+            metrics.count("pages_duplicate")
+            metrics.count("dedup_minhash")
             return list()
-        lsh.insert(url, lmh)
-        # check if page length(token count) and compare with other pages
-        page_length(url, len(tk))
-        # update the total frequencies of all words from all crawled pages
-        word_frequencies(tk)
-        # update unique count
-        global unique_count
-        unique_count += 1
-        # check sub-domain of the the url
-        p_url = urlparse(url)
-        calculate_subdomain(p_url, '.ics.uci.edu')
+        traps.record(url, False)
+        metrics.count("pages_unique")
+        # update the unique count, longest pages, word frequencies and sub-domains
+        # each thread counts its pages apart, they are merged every few pages
+        # a page counted before, such as on the last crawl, replaces what it counted then
+        analytics.add_page(url, tk, calculate_subdomain(p_url, '.ics.uci.edu'))
         # write_data()
         # return all the links in the page
-        return [link for element, attribute, link, pos in data.iterlinks()]
+        return page["links"]
     else:
-        log(f"{resp.status} - {url} - {resp.error}\n")
+        log(f"{page['status']} - {url} - {page['error']}\n")
+        # pages that could not be downloaded at all say nothing about the url
+        if page["status"] is not None:
+            traps.record(url, True)
     return list()
 
 
 def is_valid(url):
     try:
-        parsed = urlparse(url)
-        # Check if valid http/https link
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        # Check if a valid domain
-        if not re.search(rf"({valid_domains})", parsed.netloc):
-            return False
-        path = parsed.path.lower()
-        # Check if not a web page
-        if re.match(rf".*\.({invalid_types})", path):
-            return False
-        # check if path contains file type or invalid characters
-        for part in path.split("/"):
-            if part.strip() == "":
-                continue
-            # check if invalid characters are in path
-            if re.search(r"^[^a-zA-Z0-9_\-.~]", part):
-                return False
-            # check if at least one alphanumeric character
-            if not re.search(r"[a-zA-Z0-9]", part):
-                return False
-            # check if the path contains a file type that is invalid
-            if re.match(rf"^({invalid_types})$", part):
-                return False
-            # skip links that we found have little information or lead to traps/loops
-            elif re.match(rf"^({invalid_paths})$", part):
-                return False
-        return True
+        # the trap check is outside the filter's cache since its answer changes as pages are fetched
+        return url_filter.is_valid(url) and not traps.is_trap(url)
     except TypeError:
-        print("TypeError for ", parsed)
+        print("TypeError for ", url)
         raise
 
 
+# whether a url belongs to a pattern that mostly yielded junk so far, these are fetched last
+def is_low_value(url):
+    return traps.is_low_value(url)
+
+
+# returns (pages fetched, junk pages) of a host, used to rank the urls of the host
+def host_stats(host):
+    return traps.host_stats(host)
+
+
 # outputs message to a log file
 def log(message):
     # if logging disabled, do not output anything
@@ -215,125 +372,98 @@ def log(message):
     # open log file if not already open
     if not output:
         # ensure data folder exists
-        if not os.path.isdir('data'):
-            os.mkdir('data')
-            # open log file
-        output = open(f"data/{datetime.datetime.now()}.txt", "w")
-    # write message to file
-    output.write(message)
-    # flush file to save output
-    output.flush()
+        os.makedirs('data', exist_ok=True)
+        # every thread gets the same logger, the file is opened on the first line
+        output = get_file_logger("DATA", f"data/{datetime.datetime.now()}.txt")
+    # queue the message, the writer thread writes and flushes it in batches
+    output.info(message)
 
     
 # uses nltk word_tokenizer to tokenize the text from a url, returns a list of tokens
 def tokenize_words(url, text):
+    global stop_words
+    if stop_words is None:
+        stop_words = frozenset(stopwords.words())
     # preprocessing step, converts all characters to lowercase
     words = text.replace("  ", " ").replace("\n", " ").lower().strip()
     # the tokenizing step
-    tokens = word_tokenize(words)
+    if tokenizer == "regex":
+        tokens = regex_token.findall(words)
+    else:
+        tokens = word_tokenize(words)
     # this is the list of valid tokens
     ftokens = []
-    mh = MinHash(num_perm=128)
     # iterates through full token list to filter out invalid tokens
     for t in tokens:
         # do not include the token if it is a stopword
-        if t in stopwords.words():
+        if t in stop_words:
             continue
         # do not include the token if there are no alphanumeric characters
-        if not re.match('[A-Za-z0-9]+', t):
+        if not token_start.match(t):
             continue
         # remove any non-alphanumeric characters from the token
-        t2 = re.sub('[^A-Za-z0-9]+', '', t).strip()
+        t2 = token_junk.sub('', t).strip()
         # skip the token if it is an empty string
         if len(t2) <= 0:
             continue
         ftokens.append(t2)
-        mh.update(t2.encode("utf8"))
+    mh = MinHash(num_perm=128)
+    mh.update_batch([t.encode("utf8") for t in ftokens])
     return ftokens, LeanMinHash(mh)
 
 
-# evaluates the page length of a url (# of valid tokens), updates to a dictionary that tracks page lengths for all urls
-# also returns the page length
-def page_length(url, length):
-    global max_len
-    if length < max_len:
-        return
-    global pages_max
-    if length == max_len:
-        pages_max.append(url)
-    else:
-        pages_max = [url]
-        max_len = length
-
-
-# updates word frequency dict with words from current page    
-def word_frequencies(ftokens):
-    # call wordFreq dict
-    global word_dict
-    # creates dict if it does not exist yet, creates folder for word_data if it does not exist yet
-    # update wordFreq dict, iterates through each token in token list
-    for t in ftokens:
-        if t not in word_dict:
-            word_dict[t] = 0
-        word_dict[t] += 1
-
-
-# calculate the subdomains For Question4
+# returns the sub-domain of the url For Question4, None if it should not be counted
 def calculate_subdomain(parsed, suffix):
     current_page_domain = parsed.netloc
-    global subdomain_dic
     if current_page_domain.endswith(suffix) and not current_page_domain.endswith('www.ics.uci.edu'):
-        if current_page_domain in subdomain_dic:
-            subdomain_dic[current_page_domain] += 1
-        else:
-            subdomain_dic[current_page_domain] = 1
+        return current_page_domain
+    return None
 
 
 # writes all data needed for continuing after program stopped
 # writes all data needed for questions 1-4 into single file
 def write_data():
     print("Writing data...")
-    # write backup data
-    with open(token_path, "wb") as token_file:
-        pickle.dump(word_dict, token_file, protocol=pickle.HIGHEST_PROTOCOL)
-    with open(subdomain_path, "wb") as domain_file:
-        pickle.dump(subdomain_dic, domain_file, protocol=pickle.HIGHEST_PROTOCOL)
-    with open(hash_path, "wb") as hash_file:
-        pickle.dump(lsh, hash_file, protocol=pickle.HIGHEST_PROTOCOL)
-    # write report data
-    data = {"unique": unique_count, "longest": max_len, "longest_pages": pages_max,
-            "common_words": sorted(word_dict.items(), key=lambda item: item[1], reverse=True)[:50],
-            "subdomains": sorted(subdomain_dic.items(), key=lambda item: item[0].lower())}
-    with open(data_path, "w") as data_file:
-        json.dump(data,data_file, indent=4)
+    with data_lock:
+        # backup data is written as pages are added, only flush it
+        with metrics.timer("write_data"):
+            analytics.flush()
+            lsh.sync()
+            content_index.sync()
+            history.sync()
+        # write report data
+        data = analytics.report()
+        data["traps"] = traps.report()
+        with open(data_path, "w") as data_file:
+            json.dump(data,data_file, indent=4)
     print("Data written.")
 
 
 # initializes data using existing data sets
 def init():
-    # get unique page count and longest page(s)
-    if os.path.exists(data_path):
+    if os.path.exists(analytics_path) or os.path.exists(analytics_log_path):
+        # read in the background, the first pages do not wait for it
+        analytics.load_async()
+    elif os.path.exists(data_path) and os.path.exists(token_path):
+        # continue the statistics of a crawl from before the analytics log
         with open(data_path, "r") as data_file:
-            global unique_count
-            global max_len
-            global pages_max
             data = json.load(data_file)
-            unique_count = int(data["unique"])
-            max_len = int(data["longest"])
-            pages_max = data["longest_pages"]
-    # get token counts
-    if os.path.exists(token_path):
         with open(token_path, "rb") as token_file:
-            global word_dict
             word_dict = pickle.load(token_file)
-    # get sub-domain counts
-    if os.path.exists(subdomain_path):
-        with open(subdomain_path, "rb") as domain_file:
-            global subdomain_dic
-            subdomain_dic = pickle.load(domain_file)
-    # get minhash data
-    if os.path.exists(hash_path):
-        with open(hash_path, "rb") as hash_file:
-            global lsh
-            lsh = pickle.load(hash_file)
+        subdomain_dic = {}
+        if os.path.exists(subdomain_path):
+            with open(subdomain_path, "rb") as domain_file:
+                subdomain_dic = pickle.load(domain_file)
+        analytics.seed(int(data["unique"]), int(data["longest"]), data["longest_pages"],
+                       word_dict, subdomain_dic)
+    # open minhash index, its bands stay on disk
+    global lsh
+    lsh = NearDuplicateIndex(hash_path, threshold=0.75, num_perm=128,
+                             shards=hash_shards, by_host=hash_by_host)
+    # open text fingerprints, these are read into memory
+    global content_index
+    content_index = ContentIndex(content_path, simhash_distance)
+    # open the fetch history, its records stay on disk
+    global history
+    history = FetchHistory(history_path)
     print("Data initialized")
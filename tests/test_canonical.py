@@ -0,0 +1,31 @@
+import unittest
+
+from utils.canonical import canonicalize
+
+
+class CanonicalizeTest(unittest.TestCase):
+    urls = (
+        "http://www.ics.uci.edu/x/index.html/",
+        "http://www.ics.uci.edu/x/index.html/index.html//",
+        "http://www.ics.uci.edu/x//INDEX.HTM",
+        "http://www.ics.uci.edu/index.html",
+        "http://WWW.ics.uci.edu:80/a/./b/../index.php/",
+        "http://www.ics.uci.edu/a/index.html/..",
+        "http://www.ics.uci.edu/%7euser/default.asp?b=1&a=2#top",
+        "https://www.ics.uci.edu:443/a%2Eb/",
+    )
+
+    def test_idempotent(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                once = canonicalize(url)
+                self.assertEqual(canonicalize(once), once)
+
+    def test_index_pages(self):
+        self.assertEqual(canonicalize("http://www.ics.uci.edu/x/index.html/"), "http://www.ics.uci.edu/x")
+        self.assertEqual(canonicalize("http://www.ics.uci.edu/x/"), "http://www.ics.uci.edu/x")
+        self.assertEqual(canonicalize("http://www.ics.uci.edu/index.html"), "http://www.ics.uci.edu")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from utils.page_parser import parse_page
+
+
+class ParsePageTest(unittest.TestCase):
+    def test_text_after_bare_embed(self):
+        text, links, complete = parse_page(
+            b"<html><body><p>x</p><embed src=a.swf><p>after text</p></body></html>")
+        self.assertEqual(text, "xafter text")
+        self.assertEqual(links, ["a.swf"])
+        self.assertTrue(complete)
+
+    def test_skipped_content(self):
+        text, _, _ = parse_page(
+            b"<html><body><script>var a;</script><object data=a>object</object>"
+            b"<iframe src=b>iframe</iframe><textarea>form</textarea></body></html>")
+        self.assertEqual(text, "objectiframe")
+
+    def test_refresh_and_css_links(self):
+        _, links, _ = parse_page(
+            b"<html><head><meta http-equiv=refresh content=\"0; url='/next'\">"
+            b"<style>p { background: url(\"bg.png\") }</style></head>"
+            b"<body style='background: url(b.gif)'></body></html>")
+        self.assertEqual(sorted(links), ["/next", "b.gif", "bg.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,429 @@
+import os
+import json
+import zlib
+import pickle
+import sqlite3
+from threading import Thread, Lock, RLock, local
+from collections import Counter
+
+from utils.metrics import metrics
+
+
+class Accumulator(object):
+    ''' Statistics of the pages one thread added since they were last
+    merged into the shared state. Only its thread adds to it, so its lock
+    is only contended while a merge takes its pages. '''
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.unique_count = 0
+        self.max_len = -1
+        self.pages_max = []
+        self.word_dict = Counter()
+        self.subdomain_dic = Counter()
+        # urls of the pages that replaced an earlier version
+        self.replaced = []
+        # log records of the pages
+        self.records = []
+
+    def add(self, url, counts, length, subdomain, record, replaced=False):
+        if replaced:
+            self.replaced.append(url)
+        else:
+            self.unique_count += 1
+            if subdomain:
+                self.subdomain_dic[subdomain] += 1
+        if length > self.max_len:
+            self.pages_max = [url]
+            self.max_len = length
+        elif length == self.max_len:
+            self.pages_max.append(url)
+        self.word_dict.update(counts)
+        self.records.append(record)
+
+
+class PageStore(object):
+    ''' Length and token counts of every page counted, by url, in a sqlite3
+    file, so a page counted again with new text can take out what its last
+    version added. A page's row is only written when it is counted, with
+    its counts compressed. Writes are committed on sync and close. '''
+    def __init__(self, path):
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, length INTEGER, counts BLOB) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_length ON pages (length)")
+
+    def replace(self, url, length, counts):
+        ''' Saves what a page counted, as one step. Returns the (length,
+        token counts) its last version counted, None if it was not counted
+        before. '''
+        blob = zlib.compress(json.dumps(counts).encode("utf-8"), 1)
+        with self.lock:
+            row = self.db.execute("SELECT length, counts FROM pages WHERE url = ?", (url,)).fetchone()
+            self.db.execute("REPLACE INTO pages VALUES (?, ?, ?)", (url, length, blob))
+        if row is None:
+            return None
+        return row[0], json.loads(zlib.decompress(row[1]))
+
+    def longest(self):
+        ''' Returns the length of the longest pages and their urls. '''
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT url, length FROM pages WHERE length = (SELECT MAX(length) FROM pages)").fetchall()
+        if not rows:
+            return -1, []
+        return rows[0][1], [url for url, _ in rows]
+
+    def merge(self, other):
+        with other.lock:
+            rows = other.db.execute("SELECT url, length, counts FROM pages").fetchall()
+        with self.lock:
+            self.db.executemany("REPLACE INTO pages VALUES (?, ?, ?)", rows)
+
+    def sync(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class Analytics(object):
+    ''' Statistics for the crawl report.
+
+    Every unique page is appended to a log as a delta (token counts, page
+    length, subdomain). Every fold_size pages the state is written to a
+    snapshot and the log is emptied. The snapshot and the log both start
+    with a generation, bumped on every fold, and a log of an older
+    generation than the snapshot is skipped, since a crash between
+    replacing the snapshot and emptying the log left records the snapshot
+    already has. The most common words are kept up to
+    date as pages are added, so a report costs O(top_size + subdomains).
+
+    A page fetched again with new text, as on a recrawl, replaces its
+    earlier version: its delta holds the change in token counts, and it is
+    not counted as another unique page. What every page counted is kept in
+    a PageStore at pages_path, without one every page counts as new. If
+    the replaced page was the only longest page, the longest pages are
+    looked up in the page store again.
+
+    load_async reads the statistics of an earlier run in the background.
+    Pages added meanwhile are counted apart and merged with them the first
+    time the whole state is needed.
+
+    Pages are added to an accumulator of the calling thread, without taking
+    a shared lock per page or token. An accumulator is merged into the
+    shared state and logged once it has merge_size pages, and every
+    accumulator is merged before a report, flush or fold. '''
+    def __init__(self, log_path, snapshot_path, top_size=50, fold_size=1000, merge_size=20,
+                 pages_path=None):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.pages_path = pages_path
+        # opened when first used, after a partition moved to its folder
+        self._pages = None
+        self.top_size = top_size
+        self.fold_size = fold_size
+        self.merge_size = merge_size
+        # Guards the shared state below. Reentrant, since merges fold.
+        self.lock = RLock()
+        # accumulator of each thread, and all of them for merging
+        self.local = local()
+        self.accumulators = list()
+        # unique page count
+        self.unique_count = 0
+        # pages with the largest token count
+        self.max_len = -1
+        self.pages_max = []
+        # total frequency of every token
+        self.word_dict = Counter()
+        # pages found per subdomain
+        self.subdomain_dic = Counter()
+        # top_size most common words, and a lower bound of their counts
+        self.top_words = dict()
+        self.top_min = 0
+        # set once a count in the top words dropped, the top is rebuilt
+        # before the next report
+        self.top_stale = False
+        # pages in the log since the last snapshot
+        self.log_count = 0
+        self.log = None
+        # folds of the snapshot so far
+        self.generation = 0
+        # statistics of an earlier run being read by load_async
+        self.loaded = None
+        self.loader = None
+
+    @property
+    def pages(self):
+        if self._pages is None and self.pages_path is not None:
+            with self.lock:
+                if self._pages is None:
+                    self._pages = PageStore(self.pages_path)
+        return self._pages
+
+    def load(self):
+        self._check_generation()
+        self._read(self._log_size())
+        self._rebuild_top()
+
+    def load_async(self):
+        # checked now, since pages logged meanwhile go after the log read
+        self._check_generation()
+        self.loaded = Analytics(self.log_path, self.snapshot_path, self.top_size, self.fold_size)
+        self.loaded.generation = self.generation
+        self.loaded._pages = self.pages
+        # pages added from now on are logged after these records
+        self.loader = Thread(target=self.loaded._read, args=(self._log_size(),), daemon=True)
+        self.loader.start()
+
+    def _wait_loaded(self):
+        if self.loader is None:
+            return
+        self.loader.join()
+        self.loader = None
+        loaded, self.loaded = self.loaded, None
+        self.merge(loaded)
+        self.log_count += loaded.log_count
+
+    def _log_size(self):
+        return os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+
+    def _check_generation(self):
+        ''' Reads the generation of the snapshot, and empties the log if it
+        is older, as left by a crash during a fold. '''
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as snapshot_file:
+                generation = pickle.load(snapshot_file)
+            # snapshots without a generation start with the state
+            self.generation = generation if isinstance(generation, int) else 0
+        if self._log_size():
+            with open(self.log_path, "rb") as log_file:
+                header = log_file.readline()
+            # a header torn by a crash is all the log has
+            torn = not header.endswith(b"\n")
+            if torn or header.startswith(b'{"generation"') and json.loads(header)["generation"] != self.generation:
+                with self.lock:
+                    self._open_log("w")
+
+    def _read(self, log_size):
+        ''' Reads the snapshot and the first log_size bytes of the log. '''
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as snapshot_file:
+                state = pickle.load(snapshot_file)
+                if isinstance(state, int):
+                    state = pickle.load(snapshot_file)
+                (self.unique_count, self.max_len, self.pages_max,
+                 self.word_dict, self.subdomain_dic) = state
+        if log_size:
+            with open(self.log_path, "rb") as log_file:
+                lines = log_file.read(log_size).decode("utf-8").splitlines(keepends=True)
+            for line in lines:
+                # skip a record torn by a crash
+                if not line.endswith("\n"):
+                    break
+                delta = json.loads(line)
+                if "generation" in delta:
+                    continue
+                self._apply(delta["url"], Counter(delta["tokens"]),
+                            delta["length"], delta["subdomain"], delta.get("replaced", False))
+                self.log_count += 1
+
+    def seed(self, unique_count, max_len, pages_max, word_dict, subdomain_dic):
+        ''' Starts from statistics of an older crawl. '''
+        with self.lock:
+            self._wait_loaded()
+            self.unique_count = unique_count
+            self.max_len = max_len
+            self.pages_max = list(pages_max)
+            self.word_dict = Counter(word_dict)
+            self.subdomain_dic = Counter(subdomain_dic)
+            self._rebuild_top()
+            self.fold()
+
+    def add_page(self, url, tokens, subdomain=None):
+        counts = Counter(tokens)
+        delta = counts
+        replaces = self.pages.replace(url, len(tokens), counts) if self.pages is not None else None
+        if replaces is not None:
+            delta = Counter(counts)
+            delta.subtract(replaces[1])
+            # words used as often as before do not change the counts
+            delta = Counter({word: count for word, count in delta.items() if count})
+        record = json.dumps({
+            "url": url, "tokens": delta, "length": len(tokens),
+            "subdomain": subdomain, "replaced": replaces is not None}) + "\n"
+        accumulator = getattr(self.local, "accumulator", None)
+        if accumulator is None:
+            accumulator = self.local.accumulator = Accumulator()
+            with self.lock:
+                self.accumulators.append(accumulator)
+        with accumulator.lock:
+            accumulator.add(url, delta, len(tokens), subdomain, record, replaces is not None)
+            full = len(accumulator.records) >= self.merge_size
+        if full:
+            with self.lock:
+                self._merge_accumulator(accumulator)
+
+    def _merge_accumulator(self, accumulator):
+        # Must be called with self.lock held.
+        # Its thread only waits while the pages are taken, not while they
+        # are added to the shared state.
+        with accumulator.lock:
+            if not accumulator.records:
+                return
+            pages = (accumulator.unique_count, accumulator.max_len, accumulator.pages_max,
+                     accumulator.subdomain_dic)
+            word_dict, records = accumulator.word_dict, accumulator.records
+            replaced = accumulator.replaced
+            accumulator.reset()
+        for url in replaced:
+            self._replace(url)
+        self._add(*pages)
+        self._add_words(word_dict)
+        if self.log is None:
+            self._open_log("a")
+        self.log.write("".join(records))
+        self.log_count += len(records)
+        if self.log_count >= self.fold_size:
+            self.fold()
+
+    def _sync(self):
+        # Must be called with self.lock held.
+        self._wait_loaded()
+        for accumulator in self.accumulators:
+            self._merge_accumulator(accumulator)
+
+    def merge(self, other):
+        ''' Adds the statistics of another crawl, such as one partition of a
+        partitioned crawl. '''
+        with self.lock:
+            self._wait_loaded()
+            self._add(other.unique_count, other.max_len, other.pages_max, other.subdomain_dic)
+            self.word_dict.update(other.word_dict)
+            self._rebuild_top()
+            if self.pages is not None and other.pages is not None and other.pages is not self.pages:
+                self.pages.merge(other.pages)
+
+    def _add(self, unique_count, max_len, pages_max, subdomain_dic):
+        self.unique_count += unique_count
+        if max_len > self.max_len:
+            self.pages_max = list(pages_max)
+            self.max_len = max_len
+        elif max_len == self.max_len:
+            # a page already looked up in the page store may be added again
+            self.pages_max.extend(url for url in pages_max if url not in self.pages_max)
+        self.subdomain_dic.update(subdomain_dic)
+
+    def _replace(self, url):
+        # Drops an earlier version of url from the longest pages, before the
+        # new version is added.
+        # without a page store the other lengths are not known, url stays
+        if url in self.pages_max and self.pages is not None:
+            self.pages_max.remove(url)
+            if not self.pages_max:
+                # the store has the new version of url, and any page counted
+                # but not merged yet is added again without a copy
+                self.max_len, self.pages_max = self.pages.longest()
+
+    def _add_words(self, counts):
+        word_dict = self.word_dict
+        for word, count in counts.items():
+            word_dict[word] += count
+            if count < 0 and word in self.top_words:
+                self.top_stale = True
+            # a replaced page can take a word's last uses out
+            if word_dict[word] <= 0:
+                del word_dict[word]
+                continue
+            self._update_top(word, word_dict[word])
+
+    def _apply(self, url, counts, length, subdomain, replaced=False):
+        if replaced:
+            self._replace(url)
+            self._add(0, length, [url], {})
+        else:
+            self._add(1, length, [url], {subdomain: 1} if subdomain else {})
+        self._add_words(counts)
+
+    def _update_top(self, word, count):
+        if self.top_stale:
+            return
+        top = self.top_words
+        if word in top or len(top) < self.top_size:
+            top[word] = count
+            return
+        # counts only grow, so a word can only enter the top by passing
+        # the smallest count in it
+        if count <= self.top_min:
+            return
+        smallest = min(top, key=top.get)
+        if count > top[smallest]:
+            del top[smallest]
+            top[word] = count
+        self.top_min = min(top.values())
+
+    def _rebuild_top(self):
+        self.top_words = dict(
+            (word, count) for word, count in self.word_dict.most_common(self.top_size) if count > 0)
+        self.top_min = min(self.top_words.values(), default=0)
+        self.top_stale = False
+
+    def report(self):
+        with self.lock:
+            self._sync()
+            if self.top_stale:
+                self._rebuild_top()
+            return {"unique": self.unique_count, "longest": self.max_len,
+                    "longest_pages": list(self.pages_max),
+                    "common_words": sorted(self.top_words.items(), key=lambda item: item[1], reverse=True),
+                    "subdomains": sorted(self.subdomain_dic.items(), key=lambda item: item[0].lower())}
+
+    def flush(self):
+        with self.lock:
+            self._sync()
+            if self.log:
+                self.log.flush()
+            if self._pages is not None:
+                self._pages.sync()
+
+    def fold(self):
+        ''' Writes the state to the snapshot and empties the log. Pages still
+        in accumulators are logged when they are merged. '''
+        with self.lock:
+            self._wait_loaded()
+            if self._pages is not None:
+                self._pages.sync()
+            temp_path = f"{self.snapshot_path}.tmp"
+            with metrics.timer("analytics_fold"), open(temp_path, "wb") as snapshot_file:
+                pickle.dump(self.generation + 1, snapshot_file)
+                pickle.dump((self.unique_count, self.max_len, self.pages_max,
+                             self.word_dict, self.subdomain_dic),
+                            snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_path)
+            self.generation += 1
+            if self.log:
+                self.log.close()
+            self._open_log("w")
+            self.log_count = 0
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            if self.log:
+                self.log.close()
+                self.log = None
+            if self._pages is not None:
+                self._pages.close()
+                self._pages = None
+
+    def _open_log(self, mode):
+        # Must be called with self.lock held.
+        self.log = open(self.log_path, mode, encoding="utf-8")
+        if not self.log.tell():
+            self.log.write(json.dumps({"generation": self.generation}) + "\n")
@@ -0,0 +1,265 @@
+''' Local stand-in for the spacetime cache server, for offline runs,
+benchmarks and regression tests.
+
+    python -m utils.cache_server [--port 8000] [--site synthetic|recorded]
+        [--latency 0.05] [--jitter 0.02]
+
+Serves cbor encoded, pickled responses in the format utils.download and
+utils.response expect, from a synthetic web graph or from the crawl recorded
+in data/*.txt. Point a crawler at it with
+
+    python launch.py --cache_server 127.0.0.1:8000 '''
+import os
+import time
+import pickle
+import random
+from hashlib import blake2b
+from threading import Thread
+from argparse import ArgumentParser
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cbor
+import requests
+
+WORDS = (
+    "the of and to in is for on with as by at from that this be are or "
+    "research student students computer science information software "
+    "informatics statistics faculty graduate undergraduate course courses "
+    "department university irvine california data systems learning machine "
+    "network security vision graphics database theory algorithms biology "
+    "2020 2021 lab seminar talk ics uci edu professor award project news "
+    "paper papers publication conference journal workshop grant funding"
+).split()
+
+
+def make_text(rand, words):
+    # a few common words and many rare ones, so pages differ like real ones
+    return " ".join(
+        rand.choice(WORDS) if rand.random() < 0.6 else f"{rand.choice(WORDS)}{rand.randrange(5000)}"
+        for _ in range(words))
+
+
+def make_html(title, text, links):
+    anchors = "".join(f'<li><a href="{link}">{link}</a></li>' for link in links)
+    return (f"<html><head><title>{title}</title></head><body><h1>{title}</h1>"
+            f"<p>{text}</p><ul>{anchors}</ul></body></html>").encode("utf-8")
+
+
+class SyntheticSite(object):
+    ''' Deterministic web graph of hosts * pages pages.
+
+    dup_rate of the pages are near duplicates of another page of the same
+    host, with a few words changed, and mirror_rate of these are exact
+    copies. Each edition after the first changes some pages, a page more
+    often the more volatile it is, change_rate of the pages on average, so
+    recrawls have something to find. The first host also has an endless
+    calendar of nearly empty pages, and some links lead to missing pages. '''
+    def __init__(self, hosts=20, pages=200, links=8, words=300, dup_rate=0.1,
+                 mirror_rate=0.0, edition=0, change_rate=0.0, seed=0):
+        self.hosts = [f"h{i}.ics.uci.edu" for i in range(hosts)]
+        self.pages = pages
+        self.links = links
+        self.words = words
+        self.edition = edition
+        self.change_rate = change_rate
+        self.seed = seed
+        rand = random.Random(seed)
+        # duplicate page url: url of the page it copies
+        self.duplicates = dict()
+        for host in self.hosts:
+            for page in range(1, pages):
+                if rand.random() < dup_rate:
+                    self.duplicates[f"http://{host}/p{page}"] = (
+                        f"http://{host}/p{rand.randrange(page)}")
+        # duplicate page urls that copy the page exactly
+        self.mirrors = {
+            url for url in self.duplicates
+            if random.Random(f"{seed}mirror{url}").random() < mirror_rate}
+        self.seed_urls = [f"http://{host}/p0" for host in self.hosts[:2]]
+
+    def group(self, url):
+        ''' Url of the original page a url is a near duplicate of, or the
+        url itself. '''
+        while url in self.duplicates:
+            url = self.duplicates[url]
+        return url
+
+    def get(self, url):
+        ''' Returns (status, html) of a url. '''
+        parsed = urlparse(url)
+        host, path = parsed.netloc, parsed.path
+        if host not in self.hosts:
+            return 404, b""
+        if path.startswith("/calendar/"):
+            return self._calendar(host, path)
+        if not path.startswith("/p") or not path[2:].isdigit() or int(path[2:]) >= self.pages:
+            return 404, b""
+        url = f"http://{host}{path}"
+        if url in self.mirrors:
+            return self.get(self.duplicates[url])
+        rand = random.Random(f"{self.seed}{self.group(url)}")
+        text = make_text(rand, self.words)
+        if url in self.duplicates:
+            # change a few words of the copied page
+            words = text.split()
+            edit = random.Random(f"{self.seed}{url}")
+            for _ in range(len(words) // 30):
+                words[edit.randrange(len(words))] = f"edit{edit.randrange(5000)}"
+            text = " ".join(words)
+        # pages keep the words of each edition they changed in
+        for edition in range(1, self.edition + 1):
+            if self.changed(url, edition):
+                edit = random.Random(f"{self.seed}{url}edition{edition}")
+                text += f" edition{edition} " + make_text(edit, 10)
+        rand = random.Random(f"{self.seed}links{url}")
+        links = [f"/p{rand.randrange(self.pages)}" for _ in range(self.links - 2)]
+        links.append(f"http://{rand.choice(self.hosts)}/p{rand.randrange(self.pages)}")
+        links.append(f"/p{self.pages + rand.randrange(10)}" if rand.random() < 0.2
+                     else f"http://{rand.choice(self.hosts)}/p0")
+        if host == self.hosts[0] and path == "/p0":
+            links.append("/calendar/0")
+        return 200, make_html(path, text, links)
+
+    def changed(self, url, edition):
+        ''' Whether the page of url changed in an edition. '''
+        volatility = random.Random(f"{self.seed}volatility{url}").random() ** 2
+        return random.Random(f"{self.seed}{url}{edition}").random() < 3 * self.change_rate * volatility
+
+    def _calendar(self, host, path):
+        day = path.rsplit("/", 1)[-1]
+        if host != self.hosts[0] or not day.isdigit():
+            return 404, b""
+        return 200, make_html(f"day {day}", "no events", [f"/calendar/{int(day) + 1}"])
+
+
+class RecordedSite(object):
+    ''' Web graph of the crawl recorded in "status - url - text/page sizes"
+    lines of data/*.txt. Pages have the recorded status and text size. The
+    logs do not keep links, so each page links to the recorded pages one
+    path level below it and to every host's shallowest page. '''
+    def __init__(self, data_dir="data", seed=0):
+        self.seed = seed
+        self.pages = dict()
+        for name in sorted(os.listdir(data_dir)):
+            if not name.endswith(".txt"):
+                continue
+            with open(os.path.join(data_dir, name), encoding="utf-8", errors="replace") as data_file:
+                for line in data_file:
+                    parts = line.strip().split(" - ")
+                    if len(parts) < 3 or "://" not in parts[1]:
+                        continue
+                    sizes = parts[2].split("/")
+                    status = int(parts[0]) if parts[0].isdigit() else 404
+                    text_size = int(sizes[0]) if sizes[0].isdigit() else 0
+                    self.pages[parts[1].rstrip("/")] = (status, text_size)
+        self.children = dict()
+        roots = dict()
+        for url in self.pages:
+            self.children.setdefault(url.rpartition("/")[0], []).append(url)
+            host = urlparse(url).netloc
+            if host not in roots or len(url) < len(roots[host]):
+                roots[host] = url
+        self.roots = sorted(roots.values())
+        self.seed_urls = self.roots[:5]
+
+    def group(self, url):
+        # recorded pages are all different
+        return url
+
+    def get(self, url):
+        url = url.rstrip("/")
+        if url not in self.pages:
+            return 404, b""
+        status, text_size = self.pages[url]
+        if status != 200:
+            return status, b""
+        rand = random.Random(f"{self.seed}{url}")
+        text = make_text(rand, max(1, text_size // 7))
+        links = self.children.get(url, []) + self.roots
+        return 200, make_html(url, text, links)
+
+
+class CacheServer(ThreadingHTTPServer):
+    ''' Serves the pages of a site the way the cache server does, each
+    response delayed by latency plus up to jitter seconds. '''
+    daemon_threads = True
+
+    def __init__(self, site, address=("127.0.0.1", 0), latency=0.0, jitter=0.0,
+                 validators=True):
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+        # whether pages get an ETag of their content
+        self.validators = validators
+        self.requests = 0
+        super().__init__(address, CacheHandler)
+
+    def start(self):
+        ''' Serves from a background thread, returns (host, port). '''
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[:2]
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    # Keep-alive for HTTP/1.1 clients, HTTP/1.0 requests are still closed.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        query = parse_qs(urlparse(self.path).query)
+        url = query.get("q", [""])[0]
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.random() * server.jitter)
+        status, content = server.site.get(url)
+        raw = requests.models.Response()
+        raw.status_code = status
+        raw.url = url
+        raw._content = content
+        raw.headers["Content-Type"] = "text/html; charset=utf-8"
+        if server.validators and status == 200:
+            raw.headers["ETag"] = f'"{blake2b(content, digest_size=8).hexdigest()}"'
+        body = cbor.dumps({
+            "url": url, "status": status,
+            "response": pickle.dumps(raw, protocol=pickle.HIGHEST_PROTOCOL)})
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # A line per request would drown the crawler's own logs.
+        pass
+
+
+def get_site(name, data_dir="data", hosts=20, pages=200, seed=0, mirror_rate=0.0,
+             edition=0, change_rate=0.0):
+    if name == "recorded":
+        return RecordedSite(data_dir, seed)
+    return SyntheticSite(hosts, pages, mirror_rate=mirror_rate, edition=edition,
+                         change_rate=change_rate, seed=seed)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--site", choices=("synthetic", "recorded"), default="synthetic")
+    parser.add_argument("--data_dir", type=str, default="data")
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mirrors", type=float, default=0.0,
+                        help="share of the synthetic duplicates that are exact copies")
+    parser.add_argument("--edition", type=int, default=0,
+                        help="edition of the synthetic site, later editions changed pages")
+    parser.add_argument("--change_rate", type=float, default=0.1,
+                        help="share of the synthetic pages changed per edition")
+    args = parser.parse_args()
+    site = get_site(args.site, args.data_dir, args.hosts, args.pages, args.seed, args.mirrors,
+                    args.edition, args.change_rate)
+    server = CacheServer(site, ("127.0.0.1", args.port), args.latency, args.jitter)
+    print(f"Serving on 127.0.0.1:{args.port}, seed urls {','.join(site.seed_urls)}")
+    server.serve_forever()
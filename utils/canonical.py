@@ -0,0 +1,124 @@
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+# directory index pages served under the directory url as well, with the
+# slashes around them, so /x/index.html/ and /x/index.html/index.html are /x
+INDEX_PAGE = re.compile(r"(/+(index|default)\.(html?|php|asp))+/*$", re.IGNORECASE)
+ESCAPE = re.compile(r"%[0-9a-fA-F]{2}")
+UNRESERVED = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+
+# Each rule takes the (scheme, netloc, path, query, fragment) parts of a url
+# and returns them rewritten. The canonicalizer applies them in order.
+
+def lower_host(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    userinfo, at, host = netloc.rpartition("@")
+    return scheme.lower(), userinfo + at + host.lower(), path, query, fragment
+
+
+def strip_default_port(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    port = DEFAULT_PORTS.get(scheme)
+    if port and netloc.endswith(port):
+        netloc = netloc[:-len(port)]
+    return scheme, netloc, path, query, fragment
+
+
+def normalize_escapes(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    if "%" in path:
+        path = ESCAPE.sub(_normalize_escape, path)
+    return scheme, netloc, path, query, fragment
+
+
+def _normalize_escape(match):
+    # unreserved characters are decoded, every other escape is uppercased
+    char = chr(int(match.group()[1:], 16))
+    return char if char in UNRESERVED else match.group().upper()
+
+
+def resolve_dots(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    if "." not in path:
+        return parts
+    segments = []
+    for segment in path.split("/"):
+        if segment == "..":
+            if len(segments) > 1:
+                segments.pop()
+        elif segment != ".":
+            segments.append(segment)
+    # keep the directory slash of paths ending in a dot segment
+    if path.endswith(("/.", "/..")):
+        segments.append("")
+    return scheme, netloc, "/".join(segments), query, fragment
+
+
+def collapse_index(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    return scheme, netloc, INDEX_PAGE.sub("", path), query, fragment
+
+
+def strip_trailing_slash(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    return scheme, netloc, path.rstrip("/"), query, fragment
+
+
+def filter_query(parts, keep_params):
+    ''' Keeps only the whitelisted query parameters, sorted by name. None
+    keeps every parameter. '''
+    scheme, netloc, path, query, fragment = parts
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        if keep_params is not None:
+            params = [param for param in params if param[0] in keep_params]
+        query = urlencode(sorted(params, key=lambda param: param[0]))
+    return scheme, netloc, path, query, fragment
+
+
+def drop_fragment(parts, keep_params):
+    scheme, netloc, path, query, fragment = parts
+    return scheme, netloc, path, query, ""
+
+
+DEFAULT_RULES = (
+    lower_host, strip_default_port, normalize_escapes, resolve_dots,
+    strip_trailing_slash, collapse_index, filter_query, drop_fragment)
+
+
+class Canonicalizer(object):
+    ''' Rewrites urls that address the same page to one canonical form. '''
+    def __init__(self, rules=DEFAULT_RULES, keep_params=()):
+        self.rules = tuple(rules)
+        self.keep_params = (
+            None if keep_params is None else frozenset(keep_params))
+
+    @property
+    def signature(self):
+        ''' Names the rules and kept parameters, urls saved under another
+        signature may have another canonical form now. '''
+        params = "*" if self.keep_params is None else ",".join(sorted(self.keep_params))
+        return f"{','.join(rule.__name__ for rule in self.rules)};{params}"
+
+    def canonicalize(self, url):
+        parts = urlsplit(url.strip())
+        for rule in self.rules:
+            parts = rule(parts, self.keep_params)
+        return urlunsplit(parts)
+
+
+# used by utils.normalize and utils.get_urlhash
+canonicalizer = Canonicalizer()
+
+
+def configure(rules=DEFAULT_RULES, keep_params=()):
+    ''' Replaces the canonicalizer used by normalize and get_urlhash. '''
+    global canonicalizer
+    canonicalizer = Canonicalizer(rules, keep_params)
+
+
+def canonicalize(url):
+    return canonicalizer.canonicalize(url)
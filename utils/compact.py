@@ -0,0 +1,140 @@
+import os
+import mmap
+from array import array
+from bisect import bisect_left
+
+
+def get_fingerprint(urlhash):
+    ''' 64-bit fingerprint of a hex url hash, never 0. '''
+    return int(urlhash[:16], 16) or 1
+
+
+class FingerprintTable(object):
+    ''' Set of url hashes stored as 64-bit fingerprints in an open
+    addressing table with linear probing, about 8 bytes per slot instead
+    of a python string and set entry per url. '''
+    def __init__(self, capacity=1024, max_load=0.7):
+        self.max_load = max_load
+        self.slots = array("Q", bytes(8 * capacity))
+        self.mask = capacity - 1
+        self.count = 0
+
+    def _find(self, fingerprint):
+        ''' Returns the slot holding fingerprint, or the empty slot where it
+        would go. '''
+        slots, mask = self.slots, self.mask
+        i = fingerprint & mask
+        while slots[i] and slots[i] != fingerprint:
+            i = (i + 1) & mask
+        return i
+
+    def add(self, urlhash):
+        ''' Adds urlhash, returns False if it was already in the table. '''
+        fingerprint = get_fingerprint(urlhash)
+        i = self._find(fingerprint)
+        if self.slots[i]:
+            return False
+        self.slots[i] = fingerprint
+        self.count += 1
+        if self.count > self.max_load * len(self.slots):
+            self._grow()
+        return True
+
+    def __contains__(self, urlhash):
+        return bool(self.slots[self._find(get_fingerprint(urlhash))])
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        old = self.slots
+        self.slots = array("Q", bytes(16 * len(old)))
+        self.mask = len(self.slots) - 1
+        for fingerprint in old:
+            if fingerprint:
+                self.slots[self._find(fingerprint)] = fingerprint
+
+
+class FingerprintRun(object):
+    ''' Read-only sorted array of url hash fingerprints, searched by
+    bisection. Opened from a file it is memory mapped, so only the pages
+    that are searched are read from disk. '''
+    def __init__(self, fingerprints=()):
+        self.fingerprints = fingerprints
+
+    @classmethod
+    def open(cls, path):
+        if not os.path.getsize(path):
+            # an empty file can not be mapped
+            return cls()
+        with open(path, "rb") as run_file:
+            mapped = mmap.mmap(run_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memoryview(mapped).cast("Q"))
+
+    @staticmethod
+    def write(path, fingerprints):
+        ''' Writes sorted fingerprints to a file that open can map. '''
+        with open(path, "wb") as run_file:
+            array("Q", fingerprints).tofile(run_file)
+            run_file.flush()
+            os.fsync(run_file.fileno())
+
+    def __contains__(self, urlhash):
+        fingerprint = get_fingerprint(urlhash)
+        i = bisect_left(self.fingerprints, fingerprint)
+        return i < len(self.fingerprints) and self.fingerprints[i] == fingerprint
+
+    def __iter__(self):
+        return iter(self.fingerprints)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+# first byte of a packed url
+HTTP, HTTPS, FULL = b"\x00", b"\x01", b"\x02"
+
+
+def pack_url(host, url):
+    ''' Encodes url as bytes without its scheme and host, which the host
+    queue it is stored in already knows. '''
+    for flag, prefix in ((HTTPS, f"https://{host}"), (HTTP, f"http://{host}")):
+        if url.startswith(prefix):
+            return flag + url[len(prefix):].encode("utf-8")
+    return FULL + url.encode("utf-8")
+
+
+def unpack_url(host, packed):
+    rest = packed[1:].decode("utf-8")
+    flag = packed[:1]
+    if flag == HTTPS:
+        return f"https://{host}{rest}"
+    if flag == HTTP:
+        return f"http://{host}{rest}"
+    return rest
+
+
+class PackedQueue(object):
+    ''' Last in, first out queue of packed urls kept in one bytearray, each
+    followed by its 4 byte length, so queued urls cost no python object
+    each. '''
+    def __init__(self):
+        self.data = bytearray()
+        self.count = 0
+
+    def append(self, packed):
+        self.data += packed
+        self.data += len(packed).to_bytes(4, "little")
+        self.count += 1
+
+    def pop(self):
+        if not self.count:
+            raise IndexError("pop from empty queue")
+        size = int.from_bytes(self.data[-4:], "little")
+        packed = bytes(self.data[-4 - size:-4])
+        del self.data[-4 - size:]
+        self.count -= 1
+        return packed
+
+    def __len__(self):
+        return self.count
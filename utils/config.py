@@ -8,12 +8,38 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.async_tasks = config["LOCAL PROPERTIES"].getint("ASYNCTASKS", 100)
+        self.parsers = config["LOCAL PROPERTIES"].getint("PARSERS", 0)
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.commit_size = config["LOCAL PROPERTIES"].getint("COMMITSIZE", 100)
+        self.commit_interval = config["LOCAL PROPERTIES"].getfloat("COMMITINTERVAL", 1000) / 1000
+        self.compact_size = config["LOCAL PROPERTIES"].getint("COMPACTSIZE", 100000)
+        self.compact = config["LOCAL PROPERTIES"].getboolean("COMPACT", False)
+        self.frontier = config["LOCAL PROPERTIES"].get("FRONTIER", "host").strip()
+        self.priority_heap = config["LOCAL PROPERTIES"].getint("PRIORITYHEAP", 1000000)
+        self.partitions = config["LOCAL PROPERTIES"].getint("PARTITIONS", 1)
+        self.metrics = config["LOCAL PROPERTIES"].getboolean("METRICS", False)
+        self.metrics_port = config["LOCAL PROPERTIES"].getint("METRICSPORT", 0)
+        self.metrics_file = config["LOCAL PROPERTIES"].get("METRICSFILE", "metrics.json").strip()
+        self.metrics_interval = config["LOCAL PROPERTIES"].getfloat("METRICSINTERVAL", 10)
+        self.log_level = config["LOCAL PROPERTIES"].get("LOGLEVEL", "INFO").strip()
+        self.url_log_sample = config["LOCAL PROPERTIES"].getfloat("URLLOGSAMPLE", 1.0)
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.pool_size = config["CONNECTION"].getint("POOLSIZE", 10)
+        self.connect_timeout = config["CONNECTION"].getfloat("CONNECTTIMEOUT", 5)
+        self.read_timeout = config["CONNECTION"].getfloat("READTIMEOUT", 30)
+        self.retries = config["CONNECTION"].getint("RETRIES", 3)
+        self.backoff = config["CONNECTION"].getfloat("BACKOFF", 0.5)
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.max_download = config["CRAWLER"].getint("MAXDOWNLOAD", 1000000)
+        self.keep_params = [
+            param.strip() for param in config["CRAWLER"].get("KEEPPARAMS", "").split(",")
+            if param.strip()]
 
-        self.cache_server = None
\ No newline at end of file
+        self.cache_server = None
+        # Set by launch.py --recrawl.
+        self.recrawl = False
\ No newline at end of file
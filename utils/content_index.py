@@ -0,0 +1,151 @@
+import os
+from zlib import crc32
+from array import array
+from hashlib import blake2b
+from threading import Lock
+from collections import Counter
+
+import numpy
+
+from utils.compact import FingerprintTable
+
+
+def text_fingerprint(text):
+    ''' 64-bit hash of the visible text of a page, as 16 hex digits. Case
+    and whitespace do not change it. '''
+    normalized = " ".join(text.lower().split())
+    return blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def mix(values):
+    ''' Spreads 32-bit hashes over 64 bits, with the splitmix64 finalizer,
+    so similar words do not get similar bits. '''
+    values = values.astype(numpy.uint64)
+    values ^= values >> numpy.uint64(30)
+    values *= numpy.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> numpy.uint64(27)
+    values *= numpy.uint64(0x94d049bb133111eb)
+    values ^= values >> numpy.uint64(31)
+    return values
+
+
+def simhash(text):
+    ''' 64-bit SimHash of the words of a text, weighted by their counts.
+    Texts sharing most of their words differ in few bits. '''
+    counts = Counter(text.lower().split())
+    if not counts:
+        return 0
+    hashes = mix(numpy.array([crc32(word.encode("utf-8")) for word in counts], dtype=numpy.uint32))
+    weights = numpy.array(list(counts.values()), dtype=numpy.int64)
+    # a bit is set if the words with it set outweigh the others, bytes are
+    # taken lowest first on any platform
+    bits = numpy.unpackbits(hashes.astype("<u8").view(numpy.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = weights @ bits
+    return int.from_bytes(numpy.packbits(2 * votes > weights.sum(), bitorder="little").tobytes(), "little")
+
+
+class ContentIndex(object):
+    ''' Fingerprints of the text of the pages seen, checked before a page is
+    tokenized and minhashed, so exact copies cost a hash of their text.
+
+    The exact tier holds text_fingerprint of every page. The SimHash tier,
+    on if simhash_distance is set, finds pages whose SimHash differs in at
+    most simhash_distance bits. Its hashes are split into simhash_distance
+    + 1 blocks and indexed by each, since two such hashes share at least
+    one block. Both tiers are kept in memory and appended to files in path,
+    which are read back on startup. '''
+    def __init__(self, path, simhash_distance=None):
+        self.simhash_distance = simhash_distance
+        self.lock = Lock()
+        self.exact = FingerprintTable()
+        if simhash_distance is not None:
+            size = 64 // (simhash_distance + 1)
+            self.blocks = [
+                (block * size, size if block < simhash_distance else 64 - block * size)
+                for block in range(simhash_distance + 1)]
+            # block value: hashes with that value, for each block
+            self.tables = [dict() for _ in self.blocks]
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.exact_file = self._open("exact", self._add_exact)
+        self.simhash_file = None
+        if simhash_distance is not None:
+            self.simhash_file = self._open("simhash", self._add_simhash)
+
+    @staticmethod
+    def _read(path):
+        hashes = array("Q")
+        if os.path.exists(path):
+            with open(path, "rb") as hash_file:
+                data = hash_file.read()
+            # skip a hash torn by a crash
+            hashes.frombytes(data[:len(data) - len(data) % 8])
+        return hashes
+
+    def _open(self, name, add):
+        ''' Adds the hashes of a file, and opens it to append new ones. '''
+        path = os.path.join(self.path, name)
+        for value in self._read(path):
+            add(value)
+        return open(path, "ab")
+
+    def _add_exact(self, value):
+        return self.exact.add(f"{value:016x}")
+
+    def _block_keys(self, value):
+        for table, (start, size) in zip(self.tables, self.blocks):
+            yield table, (value >> start) & ((1 << size) - 1)
+
+    def _add_simhash(self, value):
+        for table, key in self._block_keys(value):
+            table.setdefault(key, []).append(value)
+
+    def _near(self, value):
+        for table, key in self._block_keys(value):
+            for other in table.get(key, ()):
+                if bin(value ^ other).count("1") <= self.simhash_distance:
+                    return True
+        return False
+
+    def check(self, fingerprint, simhash_value=None):
+        ''' Adds the hashes of a page unless a copy was seen, as one step.
+        Returns "exact" or "simhash", the tier that found a copy, or None if
+        the page is new. The SimHash tier is skipped without a SimHash. '''
+        with self.lock:
+            if not self.exact.add(fingerprint):
+                return "exact"
+            self.exact_file.write(array("Q", [int(fingerprint, 16)]).tobytes())
+            if self.simhash_file is None or simhash_value is None:
+                return None
+            if self._near(simhash_value):
+                return "simhash"
+            self._add_simhash(simhash_value)
+            self.simhash_file.write(array("Q", [simhash_value]).tobytes())
+            return None
+
+    def merge(self, other):
+        ''' Adds the hashes of another index, such as the index of one
+        partition of a partitioned crawl. '''
+        other.sync()
+        with self.lock:
+            for value in self._read(os.path.join(other.path, "exact")):
+                if self._add_exact(value):
+                    self.exact_file.write(array("Q", [value]).tobytes())
+            if self.simhash_file is None:
+                return
+            hashes = self._read(os.path.join(other.path, "simhash"))
+            for value in hashes:
+                self._add_simhash(value)
+            self.simhash_file.write(hashes.tobytes())
+
+    def sync(self):
+        with self.lock:
+            for hash_file in (self.exact_file, self.simhash_file):
+                if hash_file is not None:
+                    hash_file.flush()
+
+    def close(self):
+        with self.lock:
+            for hash_file in (self.exact_file, self.simhash_file):
+                if hash_file is not None:
+                    hash_file.close()
@@ -1,18 +1,269 @@
+import asyncio
 import requests
 import cbor
 import time
 
+from weakref import WeakKeyDictionary
+from threading import Lock
+from urllib.parse import urlencode, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from utils.response import Response
+from utils.metrics import metrics
+from utils.logs import URL_LINE
+
+# Cache server statuses that are worth retrying.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Keep-alive session shared by all workers.
+session = None
+session_lock = Lock()
+# Keep-alive connections of each event loop, since asyncio streams can not
+# be used from another loop.
+async_pools = WeakKeyDictionary()
+
+
+def backoff_time(backoff, retry):
+    ''' Seconds to wait before the retry-th retry of a download. '''
+    return backoff * 2 ** (retry - 1)
+
+
+class BackoffRetry(Retry):
+    ''' Retry that waits backoff_time before every retry, urllib3 does not
+    wait before the first one. '''
+    def get_backoff_time(self):
+        retries = len(self.history)
+        return backoff_time(self.backoff_factor, retries) if retries else 0.0
+
+
+def get_session(config):
+    global session
+    with session_lock:
+        if session is None:
+            retry = BackoffRetry(
+                total=config.retries, backoff_factor=config.backoff,
+                status_forcelist=RETRY_STATUSES, raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=config.pool_size,
+                max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+        return session
+
 
 def download(url, config, logger=None):
+    resp = _download(url, config, logger)
+    record_download(url, resp)
+    return resp
+
+
+def _download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    start = time.perf_counter()
+    try:
+        resp = get_session(config).get(
+            f"http://{host}:{port}/",
+            params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+            timeout=(config.connect_timeout, config.read_timeout),
+            stream=True)
+        # Skip the body of responses that are too large before reading it.
+        if too_large(resp.headers.get("Content-Length"), config):
+            resp.close()
+            return size_error(url, time.perf_counter() - start, logger)
+        content = resp.content
+    except requests.exceptions.RequestException as e:
+        return connection_error(url, e, time.perf_counter() - start, logger)
+    latency = time.perf_counter() - start
     if resp:
-        return Response(cbor.loads(resp.content))
+        return Response(cbor.loads(content), latency)
     logger.error(f"Spacetime Response error {resp} with url {url}.")
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
         "status": resp.status_code,
-        "url": url})
+        "url": url}, latency)
+
+
+def record_download(url, resp):
+    ''' Adds a finished download to the crawl metrics. '''
+    if not metrics.enabled:
+        return
+    metrics.observe("download", resp.latency)
+    metrics.count(f"status_{resp.status}")
+    metrics.count("download_bytes", resp.size)
+    metrics.count_host("downloads", urlparse(url).netloc.lower())
+
+
+def too_large(content_length, config):
+    return (config.max_download > 0 and content_length is not None
+            and int(content_length) > config.max_download)
+
+
+def size_error(url, latency, logger=None):
+    if logger:
+        logger.info(f"Skipped {url}, response larger than the download limit.", extra=URL_LINE)
+    return Response({
+        "error": f"Response larger than the download limit with url {url}.",
+        "status": None,
+        "url": url}, latency)
+
+
+def connection_error(url, error, latency, logger=None):
+    if logger:
+        logger.error(f"Spacetime connection error {error} with url {url}.")
+    return Response({
+        "error": f"Spacetime connection error {error} with url {url}.",
+        "status": None,
+        "url": url}, latency)
+
+
+async def async_download(url, config, logger=None):
+    resp = await _async_download(url, config, logger)
+    record_download(url, resp)
+    return resp
+
+
+async def _async_download(url, config, logger=None):
+    start = time.perf_counter()
+    for attempt in range(config.retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff_time(config.backoff, attempt))
+        try:
+            status, body = await _async_get(url, config)
+            if body is None:
+                return size_error(url, time.perf_counter() - start, logger)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            if attempt == config.retries:
+                return connection_error(
+                    url, e, time.perf_counter() - start, logger)
+            continue
+        if status not in RETRY_STATUSES or attempt == config.retries:
+            break
+    latency = time.perf_counter() - start
+    if status < 400:
+        return Response(cbor.loads(body), latency)
+    logger.error(f"Spacetime Response error <Response [{status}]> with url {url}.")
+    return Response({
+        "error": f"Spacetime Response error <Response [{status}]> with url {url}.",
+        "status": status,
+        "url": url}, latency)
+
+
+class AsyncPool(object):
+    ''' Idle keep-alive HTTP/1.1 connections to the cache server, for the
+    downloads of one event loop. Like the session of the threaded workers,
+    more connections are opened while every idle one is in use, and at most
+    size of them are kept once they are done. '''
+    def __init__(self, size):
+        self.size = size
+        self.idle = list()
+
+    def get(self):
+        ''' Returns an idle (reader, writer) connection, None if there is
+        none. '''
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def put(self, connection):
+        if len(self.idle) < self.size:
+            self.idle.append(connection)
+        else:
+            connection[1].close()
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+def get_async_pool(config):
+    loop = asyncio.get_running_loop()
+    with session_lock:
+        pool = async_pools.get(loop)
+        if pool is None:
+            pool = async_pools[loop] = AsyncPool(config.pool_size)
+        return pool
+
+
+def close_async_pool():
+    ''' Closes the idle connections of the running event loop. '''
+    with session_lock:
+        pool = async_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        pool.close()
+
+
+async def _async_get(url, config):
+    host, port = config.cache_server
+    query = urlencode([("q", f"{url}"), ("u", f"{config.user_agent}")])
+    request = f"GET /?{query} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode()
+    pool = get_async_pool(config)
+    connection = pool.get()
+    if connection is not None:
+        try:
+            return await _async_request(connection, request, pool, config)
+        except (OSError, asyncio.IncompleteReadError):
+            # The server closed the idle connection, which is not a failed
+            # download, so it is sent again on a new connection.
+            pass
+    connection = await asyncio.wait_for(
+        asyncio.open_connection(host, port), config.connect_timeout)
+    return await _async_request(connection, request, pool, config)
+
+
+async def _async_request(connection, request, pool, config):
+    reader, writer = connection
+    keep_alive = False
+    try:
+        writer.write(request)
+        await asyncio.wait_for(writer.drain(), config.read_timeout)
+        head = await asyncio.wait_for(
+            reader.readuntil(b"\r\n\r\n"), config.read_timeout)
+        lines = head.split(b"\r\n")
+        version, status = lines[0].split(b" ", 2)[:2]
+        headers = dict()
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get(b"content-length")
+        # Skip the body of responses that are too large before reading it.
+        if too_large(length, config):
+            return int(status), None
+        reusable = True
+        if length is not None:
+            body = await asyncio.wait_for(
+                reader.readexactly(int(length)), config.read_timeout)
+        elif headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+            body = await asyncio.wait_for(_read_chunked(reader), config.read_timeout)
+        else:
+            # No length, the body is everything up to the end of stream.
+            body = await asyncio.wait_for(reader.read(), config.read_timeout)
+            reusable = False
+        connection_header = headers.get(b"connection", b"").lower()
+        keep_alive = reusable and (
+            connection_header == b"keep-alive"
+            or version == b"HTTP/1.1" and connection_header != b"close")
+    finally:
+        if keep_alive:
+            pool.put(connection)
+        else:
+            writer.close()
+    return int(status), body
+
+
+async def _read_chunked(reader):
+    chunks = list()
+    while True:
+        size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+        if not size:
+            break
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+    # skip the trailers up to the empty line
+    while await reader.readuntil(b"\r\n") != b"\r\n":
+        pass
+    return b"".join(chunks)
@@ -0,0 +1,102 @@
+import math
+import time
+
+from threading import Lock
+from collections import namedtuple
+
+from utils import get_urlhash
+from utils.store import open_shelf
+
+# Chance of a change given to urls fetched only once, whose change rate is
+# not known yet.
+UNKNOWN_ODDS = 0.5
+
+# What the last fetch of a url returned, and how often it was fetched and
+# found changed. validators is the (ETag, Last-Modified) of the response.
+FetchRecord = namedtuple("FetchRecord", (
+    "url", "status", "validators", "fingerprint",
+    "first_fetch", "last_fetch", "fetches", "changes"))
+
+
+def change_odds(record, now):
+    ''' Estimated chance that the url of a record changed since its last
+    fetch. Of n fetches after the first, c found a change, so the change
+    rate is -log((n - c + 0.5) / (n + 0.5)) per mean fetch interval (Cho
+    and Garcia-Molina's estimator), and the chance of a change in the time
+    since the last fetch is 1 - exp(-rate * time). '''
+    compared = record.fetches - 1
+    if compared < 1 or record.last_fetch <= record.first_fetch:
+        return UNKNOWN_ODDS
+    interval = (record.last_fetch - record.first_fetch) / compared
+    rate = -math.log((compared - record.changes + 0.5) / (compared + 0.5)) / interval
+    return 1 - math.exp(-rate * max(0.0, now - record.last_fetch))
+
+
+def is_changed(record, status, validators, fingerprint):
+    ''' Whether a fetch differs from the last one. The text fingerprints
+    are compared if the page was parsed, else the validators. '''
+    if status != record.status:
+        return True
+    if fingerprint is not None:
+        return fingerprint != record.fingerprint
+    return validators != record.validators
+
+
+class FetchHistory(object):
+    ''' Last fetch of every url downloaded, in a shelve at path, kept across
+    crawls so a recrawl can tell which pages changed and fetch the pages
+    that change most often first. '''
+    def __init__(self, path):
+        self.lock = Lock()
+        self.db = open_shelf(path)
+
+    def get(self, url):
+        with self.lock:
+            return self.db.get(get_urlhash(url))
+
+    def record(self, url, status, validators=None, fingerprint=None, now=None):
+        ''' Saves a fetch of url. A fingerprint of None keeps the last one if
+        the page did not change, such as a page not parsed since its
+        validators matched. Returns whether the page changed, None on its
+        first fetch. '''
+        now = time.time() if now is None else now
+        urlhash = get_urlhash(url)
+        with self.lock:
+            old = self.db.get(urlhash)
+            if old is None:
+                self.db[urlhash] = FetchRecord(
+                    url, status, validators, fingerprint, now, now, 1, 0)
+                return None
+            changed = is_changed(old, status, validators, fingerprint)
+            if fingerprint is None and not changed:
+                fingerprint = old.fingerprint
+            self.db[urlhash] = FetchRecord(
+                url, status, validators, fingerprint, old.first_fetch, now,
+                old.fetches + 1, old.changes + changed)
+            return changed
+
+    def recrawl_order(self, now=None):
+        ''' Returns (url, chance it changed) of every url fetched, most likely
+        changed first. '''
+        now = time.time() if now is None else now
+        with self.lock:
+            urls = [(record.url, change_odds(record, now)) for record in self.db.values()]
+        urls.sort(key=lambda item: item[1], reverse=True)
+        return urls
+
+    def merge(self, other):
+        ''' Adds the urls of another history, such as the history of one
+        partition of a partitioned crawl. '''
+        with self.lock:
+            for urlhash, record in other.db.items():
+                old = self.db.get(urlhash)
+                if old is None or record.last_fetch > old.last_fetch:
+                    self.db[urlhash] = record
+
+    def sync(self):
+        with self.lock:
+            self.db.sync()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
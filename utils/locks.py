@@ -0,0 +1,79 @@
+import time
+from threading import Lock
+
+
+class TimedLock(object):
+    ''' Lock that records how often and how long callers waited for it. '''
+    def __init__(self):
+        self.lock = Lock()
+        self.acquired = 0
+        self.contended = 0
+        self.wait_time = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.acquired += 1
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        if not self.lock.acquire(True, timeout):
+            return False
+        # Counters are only changed while holding the lock.
+        self.acquired += 1
+        self.contended += 1
+        self.wait_time += time.perf_counter() - start
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class StripedSet(object):
+    ''' Set of url hashes split by hash prefix into stripes, each with its
+    own lock, so that threads adding different urls rarely contend. Each
+    stripe is made by factory, which must support add, in and len. Hashes
+    in base, a read-only set such as the urls of a checkpoint, count as
+    added already. '''
+    def __init__(self, stripes=16, factory=set, base=()):
+        self.stripes = [(TimedLock(), factory()) for _ in range(stripes)]
+        self.base = base
+
+    def _stripe(self, urlhash):
+        return self.stripes[int(urlhash[:4], 16) % len(self.stripes)]
+
+    def add(self, urlhash):
+        ''' Adds urlhash, returns False if it was already in the set. '''
+        if urlhash in self.base:
+            return False
+        lock, stripe = self._stripe(urlhash)
+        with lock:
+            if urlhash in stripe:
+                return False
+            stripe.add(urlhash)
+            return True
+
+    def __contains__(self, urlhash):
+        if urlhash in self.base:
+            return True
+        lock, stripe = self._stripe(urlhash)
+        with lock:
+            return urlhash in stripe
+
+    def __len__(self):
+        return len(self.base) + sum(len(stripe) for _, stripe in self.stripes)
+
+    @property
+    def contended(self):
+        return sum(lock.contended for lock, _ in self.stripes)
+
+    @property
+    def wait_time(self):
+        return sum(lock.wait_time for lock, _ in self.stripes)
@@ -0,0 +1,195 @@
+import os
+import sys
+import atexit
+import random
+import logging
+
+from queue import SimpleQueue, Empty
+from threading import Thread, Lock, Event
+from logging.handlers import QueueHandler
+
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Records written before the files are flushed while records keep coming.
+BATCH_SIZE = 1000
+# Pass as extra to log calls made once per url, these are sampled.
+URL_LINE = {"url_line": True}
+
+
+class UrlLineSampler(logging.Filter):
+    ''' Passes rate of the per url records and every other record. '''
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or not getattr(record, "url_line", False):
+            return True
+        return random.random() < self.rate
+
+
+class WriterHandler(QueueHandler):
+    ''' Formats records in the calling thread, so the time they carry is
+    when they were logged, and queues them for the log writer with the file
+    they go to. '''
+    def __init__(self, writer, path, console, terminator):
+        super().__init__(writer.queue)
+        self.path = path
+        self.console = console
+        self.terminator = terminator
+
+    def prepare(self, record):
+        # The record is only seen by this handler, so it is changed in
+        # place instead of copied.
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        record.log_path = self.path
+        record.log_console = self.console
+        record.log_terminator = self.terminator
+        return record
+
+
+class LogWriter(Thread):
+    ''' Writes the records of every logger of this process from one thread,
+    so workers never wait for the disk or the console. Files are flushed
+    once the queue is empty, or every BATCH_SIZE records while it is not. '''
+    def __init__(self, batch_size=BATCH_SIZE):
+        super().__init__(daemon=True)
+        self.queue = SimpleQueue()
+        self.batch_size = batch_size
+        # path: open file
+        self.files = dict()
+
+    def run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            streams = set()
+            for record in records:
+                if record is None:
+                    self._flush(streams)
+                    return
+                if isinstance(record, Event):
+                    # Set by flush once everything before it is written.
+                    self._flush(streams)
+                    streams.clear()
+                    record.set()
+                    continue
+                self._write(record, streams)
+            self._flush(streams)
+
+    def _write(self, record, streams):
+        try:
+            stream = self.files.get(record.log_path)
+            if stream is None:
+                stream = self.files[record.log_path] = open(
+                    record.log_path, "a", encoding="utf-8")
+            stream.write(record.msg + record.log_terminator)
+            streams.add(stream)
+            if record.log_console and record.levelno >= logging.INFO:
+                sys.stderr.write(record.msg + "\n")
+                streams.add(sys.stderr)
+        except OSError as error:
+            # A full disk must not stop the writer, or the queue would grow
+            # without bound.
+            sys.stderr.write(f"Could not write to {record.log_path}: {error}\n")
+
+    @staticmethod
+    def _flush(streams):
+        for stream in streams:
+            try:
+                stream.flush()
+            except OSError:
+                pass
+
+    def flush(self, timeout=None):
+        ''' Waits until every record logged so far is written. '''
+        done = Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+        for stream in self.files.values():
+            stream.close()
+
+
+# writer of this process, started by the first logger
+writer = None
+writer_lock = Lock()
+# names of the loggers made by get_logger, whose level configure sets
+loggers = set()
+loggers_lock = Lock()
+level = "INFO"
+sampler = UrlLineSampler()
+
+
+def get_writer():
+    global writer
+    with writer_lock:
+        if writer is None:
+            writer = LogWriter()
+            writer.start()
+            atexit.register(writer.stop)
+        return writer
+
+
+def configure(log_level="INFO", url_sample=1.0):
+    ''' Sets the level of the crawler's loggers and the share of per url
+    records they keep. '''
+    global level
+    level = log_level.upper()
+    sampler.rate = url_sample
+    with loggers_lock:
+        for name in loggers:
+            logging.getLogger(name).setLevel(level)
+
+
+def _add_handler(logger, path, formatter, console, terminator):
+    # Must be called with loggers_lock held, once per logger.
+    handler = WriterHandler(get_writer(), os.path.abspath(path), console, terminator)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    logger.addFilter(sampler)
+    logger.propagate = False
+
+
+def get_logger(name, filename=None):
+    ''' Logger writing to Logs/<filename or name>.log and to the console.
+    Every call with the same name returns the same logger, with one
+    handler. '''
+    logger = logging.getLogger(name)
+    with loggers_lock:
+        if name in loggers:
+            return logger
+        logger.setLevel(level)
+        if not os.path.exists("Logs"):
+            os.makedirs("Logs", exist_ok=True)
+        _add_handler(logger, f"Logs/{filename if filename else name}.log",
+                     logging.Formatter(FORMAT), True, "\n")
+        loggers.add(name)
+    return logger
+
+
+def get_file_logger(name, path):
+    ''' Logger writing its messages as they are to path, such as the data
+    records of the scraper. Its level is not changed by configure. '''
+    logger = logging.getLogger(name)
+    with loggers_lock:
+        if not logger.handlers:
+            logger.setLevel(logging.INFO)
+            _add_handler(logger, path, logging.Formatter("%(message)s"), False, "")
+    return logger
+
+
+def flush(timeout=None):
+    ''' Waits until the records logged so far are written. '''
+    if writer is not None:
+        writer.flush(timeout)
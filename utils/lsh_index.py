@@ -0,0 +1,82 @@
+import os
+from zlib import crc32
+from hashlib import blake2b
+from threading import Lock
+
+from datasketch import MinHashLSH
+
+from utils.store import open_db
+
+
+class NearDuplicateIndex(object):
+    ''' MinHash LSH index with its band tables in sqlite3 files on disk.
+
+    Each band of a MinHash is stored as a short hash key, so inserts are
+    appended to disk as they happen and nothing is loaded on startup.
+    Bands are spread over shards by band number. If by_host is set the
+    host is hashed into the band keys, so near duplicates are only found
+    among pages of the same host, and the bands of a host go to one shard. '''
+    def __init__(self, path, threshold=0.75, num_perm=128, shards=4, by_host=False):
+        # Use the bands and rows datasketch picks for the threshold.
+        params = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.bands, self.rows = params.b, params.r
+        self.by_host = by_host
+        self.lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self.shards = [
+            open_db(os.path.join(path, f"shard{i}"))
+            for i in range(shards)]
+
+    def _band_keys(self, minhash, host):
+        if self.by_host:
+            host = host.encode("utf-8")
+            shard = self.shards[crc32(host) % len(self.shards)]
+        for band in range(self.bands):
+            start = band * self.rows
+            digest = blake2b(
+                minhash.hashvalues[start:start + self.rows].tobytes(),
+                digest_size=8)
+            if self.by_host:
+                digest.update(host)
+            else:
+                shard = self.shards[band % len(self.shards)]
+            yield shard, bytes((band,)) + digest.digest()
+
+    def insert_unique(self, key, minhash, host=""):
+        ''' Inserts minhash unless a near duplicate is indexed, as one step,
+        so two threads can not both insert copies of a page. An earlier
+        version of the page under the same key is not a near duplicate, and
+        the bands of the new version are stored under the key too. Returns
+        the keys of the near duplicates, empty if minhash was inserted. '''
+        with self.lock:
+            band_keys = list(self._band_keys(minhash, host))
+            similar = {
+                value.decode("utf-8")
+                for value in (shard.get(band_key) for shard, band_key in band_keys)
+                if value is not None}
+            similar.discard(key)
+            if not similar:
+                for shard, band_key in band_keys:
+                    shard[band_key] = key.encode("utf-8")
+            return similar
+
+    def merge(self, other):
+        ''' Adds the bands of another index with the same number of shards,
+        such as the index of one partition of a partitioned crawl. '''
+        with self.lock:
+            for shard, other_shard in zip(self.shards, other.shards):
+                for key in other_shard.keys():
+                    if key not in shard:
+                        shard[key] = other_shard[key]
+
+    def sync(self):
+        with self.lock:
+            for shard in self.shards:
+                # Not every dbm implementation buffers writes.
+                if hasattr(shard, "sync"):
+                    shard.sync()
+
+    def close(self):
+        with self.lock:
+            for shard in self.shards:
+                shard.close()
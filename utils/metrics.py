@@ -0,0 +1,185 @@
+import os
+import json
+import time
+
+from threading import Thread, Lock
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Hosts listed in a snapshot, by downloads.
+TOP_HOSTS = 20
+
+
+class Histogram(object):
+    ''' Latencies in power of two buckets of microseconds. '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = Counter()
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[int(seconds * 1e6).bit_length()] += 1
+
+    def percentile(self, share):
+        ''' Upper bound of the bucket holding the given share of the
+        observations, in seconds. '''
+        rank = share * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return (1 << bucket) / 1e6
+        return self.max
+
+    def report(self):
+        return {"count": self.count, "total": self.total,
+                "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(0.5), "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99), "max": self.max}
+
+
+class Timer(object):
+    ''' Context manager that observes the time spent in its block. '''
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class NullTimer(object):
+    ''' Timer used while metrics are disabled, does nothing. '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics(object):
+    ''' Counters, latency histograms, per host counters and gauges of a
+    crawl.
+
+    Disabled until start is called, and while disabled every method returns
+    right away. When enabled, snapshots are served as JSON on a local HTTP
+    port and written to a file every interval seconds. '''
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters = Counter()
+        self.histograms = dict()
+        # name: Counter of host: count
+        self.hosts = dict()
+        # name: function returning the current value
+        self.gauges = dict()
+        self.dump_file = None
+        self.server = None
+
+    def start(self, port=0, dump_file=None, interval=10):
+        ''' Enables the metrics. Serves snapshots on 127.0.0.1:port unless
+        port is 0, and writes them to dump_file every interval seconds. '''
+        self.enabled = True
+        self.started = time.time()
+        self.dump_file = dump_file
+        if port:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            Thread(target=self.server.serve_forever, daemon=True).start()
+        if dump_file:
+            Thread(target=self._dump_loop, args=(interval,), daemon=True).start()
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+
+    def count_host(self, name, host, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.hosts.setdefault(name, Counter())[host] += value
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def gauge(self, name, function):
+        ''' Registers a function whose value is read when a snapshot is
+        taken, such as a queue depth. '''
+        self.gauges[name] = function
+
+    def snapshot(self):
+        uptime = time.time() - self.started
+        with self.lock:
+            report = {
+                "uptime": uptime,
+                "counters": dict(self.counters),
+                "rates": {name: count / uptime for name, count in self.counters.items()},
+                "latency": {name: histogram.report()
+                            for name, histogram in self.histograms.items()},
+                "hosts": {name: {host: {"count": count, "rate": count / uptime}
+                                 for host, count in hosts.most_common(TOP_HOSTS)}
+                          for name, hosts in self.hosts.items()}}
+        report["gauges"] = {name: function() for name, function in self.gauges.items()}
+        return report
+
+    def dump(self):
+        if not self.enabled or not self.dump_file:
+            return
+        temp_file = f"{self.dump_file}.tmp"
+        with open(temp_file, "w") as dump_file:
+            json.dump(self.snapshot(), dump_file, indent=4)
+        os.replace(temp_file, self.dump_file)
+
+    def _dump_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            self.dump()
+
+    def _handler(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot(), indent=4).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Requests are not worth a line on stderr each.
+                pass
+
+        return Handler
+
+
+# metrics of this process, started by the crawler when METRICS is set
+metrics = Metrics()
@@ -0,0 +1,92 @@
+import re
+
+from lxml import etree
+from lxml.html.defs import link_attrs
+
+# elements whose content is not visible text, what Cleaner(style=True) removes
+# the content of object, iframe and embed is kept, as the cleaner keeps it
+SKIPPED_TAGS = frozenset((
+    "script", "style", "applet", "frame", "frameset", "noframes",
+    "button", "input", "select", "textarea"))
+# links in css and refresh headers, as lxml's iterlinks finds them
+CSS_URL = re.compile(r"url\((\"[^\"]*\"|'[^']*'|[^)]*)\)", re.I)
+CSS_IMPORT = re.compile(r'@import "(.*?)"')
+REFRESH_URL = re.compile(r"[^;=]*;\s*(?:url\s*=\s*)?(?P<url>.*)$", re.I)
+# bytes fed to the parser at a time
+CHUNK_SIZE = 16384
+
+
+class PageTarget(object):
+    ''' lxml parser target that collects the visible text and the links of
+    a page while it is being parsed. '''
+    def __init__(self):
+        self.text = []
+        self.text_size = 0
+        self.links = []
+        # depth inside elements whose text is skipped
+        self.skip_depth = 0
+        # text of the style element being parsed, None outside of one
+        self.style = None
+
+    def start(self, tag, attrib):
+        if self.skip_depth or tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        if tag == "style":
+            self.style = []
+        for name, value in attrib.items():
+            if name in link_attrs:
+                self.links.append(value.strip())
+        if tag == "meta" and attrib.get("http-equiv", "").lower() == "refresh":
+            content = attrib.get("content", "")
+            match = REFRESH_URL.search(content)
+            url = unquote((match.group("url") if match else content).strip())
+            if url:
+                self.links.append(url)
+        if "style" in attrib:
+            self.css_links(attrib["style"])
+
+    def end(self, tag):
+        if self.skip_depth:
+            self.skip_depth -= 1
+        if tag == "style" and self.style is not None:
+            css, self.style = "".join(self.style), None
+            self.css_links(css)
+            self.links.extend(match.group(1) for match in CSS_IMPORT.finditer(css))
+
+    def data(self, data):
+        if self.style is not None:
+            self.style.append(data)
+        if not self.skip_depth:
+            self.text.append(data)
+            self.text_size += len(data)
+
+    def css_links(self, css):
+        self.links.extend(unquote(match.group(1).strip()) for match in CSS_URL.finditer(css))
+
+    def close(self):
+        return self
+
+
+def unquote(url):
+    if url[:1] == url[-1:] and url[:1] in ("'", '"'):
+        return url[1:-1].strip()
+    return url
+
+
+def parse_page(content, min_text=0):
+    ''' Parses the page once, returns (text, links, complete).
+
+    The page is fed to the parser in chunks. Once the text found so far
+    plus every byte left can no longer reach min_text characters, parsing
+    stops and complete is False. '''
+    target = PageTarget()
+    parser = etree.HTMLParser(target=target, remove_blank_text=True)
+    page_size = len(content)
+    for start in range(0, page_size, CHUNK_SIZE):
+        parser.feed(content[start:start + CHUNK_SIZE])
+        # the parser may still hold up to a chunk that has not reached the target
+        remaining = page_size - start
+        if target.text_size + remaining < min_text:
+            return "".join(target.text), target.links, False
+    parser.close()
+    return "".join(target.text), target.links, True
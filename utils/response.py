@@ -1,14 +1,26 @@
 import pickle
 
 class Response(object):
-    def __init__(self, resp_dict):
+    def __init__(self, resp_dict, latency=None):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        # The pickled requests.Response, only decoded when raw_response is
+        # first used.
+        self._pickled = resp_dict["response"] if "response" in resp_dict else None
+        self._raw_response = None
+        # Size of the pickled response, a bit larger than its content, taken
+        # now since the pickle is dropped once decoded.
+        self.size = len(self._pickled) if isinstance(self._pickled, bytes) else 0
+        # Seconds spent fetching the response from the cache server.
+        self.latency = latency
+
+    @property
+    def raw_response(self):
+        if self._pickled is not None:
+            try:
+                self._raw_response = pickle.loads(self._pickled)
+            except TypeError:
+                self._raw_response = None
+            self._pickled = None
+        return self._raw_response
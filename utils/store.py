@@ -0,0 +1,92 @@
+import os
+import dbm
+import shelve
+import sqlite3
+from threading import Lock
+
+
+class SqliteDB(object):
+    ''' dbm style mapping of bytes keys to bytes values in one sqlite3 file.
+
+    The dbm module falls back to dbm.dumb where no gdbm or ndbm is built,
+    which rewrites its whole index on every sync and reads it on open. This
+    keeps one indexed table instead, on any platform. Writes are committed
+    on sync and close, so a crash loses the writes since the last sync. '''
+    def __init__(self, path):
+        self.lock = Lock()
+        # Shared by the threads of the index, history or journal using it,
+        # which hold their own locks around it.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID")
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.db.execute("REPLACE INTO kv (key, value) VALUES (?, ?)", (key, value))
+
+    def __delitem__(self, key):
+        with self.lock:
+            if not self.db.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount:
+                raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def keys(self):
+        with self.lock:
+            return [key for key, in self.db.execute("SELECT key FROM kv")]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        with self.lock:
+            return self.db.execute("SELECT key, value FROM kv").fetchall()
+
+    def sync(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def open_db(path):
+    ''' Opens the dbm style file at path, made if missing. Files of a gdbm
+    or ndbm module are opened with it, and dbm.dumb files are copied into a
+    new sqlite3 file at path and removed. '''
+    kind = dbm.whichdb(path)
+    if kind and kind != "dbm.dumb":
+        return dbm.open(path, "c")
+    db = SqliteDB(path)
+    if kind == "dbm.dumb":
+        with dbm.open(path, "r") as old:
+            for key in old.keys():
+                db[key] = old[key]
+        db.sync()
+        for suffix in (".dat", ".dir", ".bak"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return db
+
+
+def open_shelf(path):
+    ''' shelve.open on the file open_db opens. '''
+    return shelve.Shelf(open_db(path))
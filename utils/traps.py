@@ -0,0 +1,98 @@
+import re
+from threading import Lock
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl
+
+from utils import get_urlhash
+
+DIGITS = re.compile(r"[0-9]+")
+
+
+class TrapDetector(object):
+    ''' Learns which url patterns keep yielding junk pages, like calendars,
+    wikis and paginated listings, so they can be crawled last or not at all.
+
+    Urls are grouped into patterns of host, first path segment with digits
+    generalized, path depth and query parameter names. A pattern is low value
+    once low_ratio of at least min_samples of its pages were junk, and is
+    blocked once it has used up its budget of junk pages and block_ratio of
+    its pages were junk. Paths deeper than max_depth or repeating a segment
+    more than max_repeats times are blocked without being fetched. '''
+    def __init__(self, max_depth=12, max_repeats=2, min_samples=20,
+                 low_ratio=0.5, block_ratio=0.9, budget=50):
+        self.max_depth = max_depth
+        self.max_repeats = max_repeats
+        self.min_samples = min_samples
+        self.low_ratio = low_ratio
+        self.block_ratio = block_ratio
+        self.budget = budget
+        self.lock = Lock()
+        # pattern: [pages fetched, junk pages]
+        self.stats = dict()
+        # host: [pages fetched, junk pages]
+        self.hosts = dict()
+        # patterns blocked so far, and how many urls each has rejected
+        self.blocked = Counter()
+        # hashes of the urls rejected, since a url is checked again on every
+        # page linking to it and when the frontier pops it
+        self.rejected = set()
+
+    def record(self, url, junk):
+        ''' Records the outcome of a fetched page: junk pages were errors,
+        skipped, had too little text or were near duplicates. '''
+        parsed = urlsplit(url)
+        pattern = get_pattern(parsed)
+        with self.lock:
+            for stats in (self.stats.setdefault(pattern, [0, 0]),
+                          self.hosts.setdefault(parsed.netloc.lower(), [0, 0])):
+                stats[0] += 1
+                if junk:
+                    stats[1] += 1
+
+    def is_trap(self, url):
+        ''' True if the url should not be fetched. '''
+        parsed = urlsplit(url)
+        segments = [segment for segment in parsed.path.split("/") if segment]
+        if len(segments) > self.max_depth:
+            return True
+        if segments and Counter(segments).most_common(1)[0][1] > self.max_repeats:
+            return True
+        pattern = get_pattern(parsed)
+        with self.lock:
+            fetched, junk = self.stats.get(pattern, (0, 0))
+            if junk >= self.budget and junk >= self.block_ratio * fetched:
+                urlhash = get_urlhash(url)
+                if urlhash not in self.rejected:
+                    self.rejected.add(urlhash)
+                    self.blocked[pattern] += 1
+                return True
+        return False
+
+    def is_low_value(self, url):
+        ''' True if the url should only be fetched after the other urls of
+        its host. '''
+        pattern = get_pattern(urlsplit(url))
+        with self.lock:
+            fetched, junk = self.stats.get(pattern, (0, 0))
+        return fetched >= self.min_samples and junk >= self.low_ratio * fetched
+
+    def host_stats(self, host):
+        ''' Returns (pages fetched, junk pages) of a host. '''
+        with self.lock:
+            return tuple(self.hosts.get(host, (0, 0)))
+
+    def report(self):
+        with self.lock:
+            return {
+                "patterns": len(self.stats),
+                "blocked": {pattern: {"fetched": self.stats[pattern][0],
+                                      "junk": self.stats[pattern][1],
+                                      "rejected": rejected}
+                            for pattern, rejected in self.blocked.most_common()}}
+
+
+def get_pattern(parsed):
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    first = DIGITS.sub("N", segments[0]) if segments else ""
+    params = ",".join(sorted({name for name, _ in parse_qsl(parsed.query, keep_blank_values=True)}))
+    return f"{parsed.netloc.lower()}/{first}/*{len(segments)}?{params}"
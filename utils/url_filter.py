@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# characters a path segment may start with
+SEGMENT_START = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-.~")
+
+
+def expand_alternatives(pattern):
+    ''' Expands "a|bc?" into {"a", "b", "bc"}. Only supports alternatives
+    with at most one optional character. '''
+    words = set()
+    for word in pattern.split("|"):
+        if "?" in word:
+            i = word.index("?")
+            words.add(word[:i] + word[i + 1:])
+            words.add(word[:i - 1] + word[i + 1:])
+        else:
+            words.add(word)
+    return frozenset(words)
+
+
+class UrlFilter(object):
+    ''' The is_valid rules compiled once. Results are cached per
+    (netloc, path), since the same links show up on many pages. '''
+    def __init__(self, valid_domains, invalid_types, invalid_paths, cache_size=2 ** 16):
+        self.valid_domain = re.compile(rf"({valid_domains})")
+        # same as matching ".*\.(types)" against the whole path
+        self.invalid_type = re.compile(rf"\.({invalid_types})")
+        self.has_alnum = re.compile(r"[a-zA-Z0-9]")
+        self.invalid_types = expand_alternatives(invalid_types)
+        self.invalid_paths = expand_alternatives(invalid_paths)
+        self._check = lru_cache(maxsize=cache_size)(self._check)
+
+    def is_valid(self, url):
+        parsed = urlparse(url)
+        # Check if valid http/https link
+        if parsed.scheme not in ("http", "https"):
+            return False
+        return self._check(parsed.netloc, parsed.path)
+
+    def filter_urls(self, urls):
+        ''' Returns the valid urls, without duplicates, in order. '''
+        valid = dict()
+        for url in urls:
+            if url not in valid:
+                valid[url] = self.is_valid(url)
+        return [url for url, ok in valid.items() if ok]
+
+    def _check(self, netloc, path):
+        # Check if a valid domain
+        if not self.valid_domain.search(netloc):
+            return False
+        path = path.lower()
+        # Check if not a web page
+        if self.invalid_type.search(path):
+            return False
+        # check if path contains file type or invalid characters
+        for part in path.split("/"):
+            if part.strip() == "":
+                continue
+            # check if invalid characters are in path
+            if part[0] not in SEGMENT_START:
+                return False
+            # check if at least one alphanumeric character
+            if not self.has_alnum.search(part):
+                return False
+            # check if the path contains a file type that is invalid
+            if part in self.invalid_types:
+                return False
+            # skip links that we found have little information or lead to traps/loops
+            if part in self.invalid_paths:
+                return False
+        return True